@@ -0,0 +1,181 @@
+from __future__ import print_function
+import hashlib
+import os
+
+from latexcv import PACKAGE_DIR, LaTEXCVMakerError, _resolve_variant, compile_tex, make_build_steps, render_tex
+
+# spacing parameters (in pt) from the loosest (the defaults of the templates) to the tightest:
+#   negspace:  `\negspace` between sections
+#   top_space: space above the first section
+SPACINGS = (
+    {'negspace': -28, 'top_space': -15},
+    {'negspace': -30, 'top_space': -18},
+    {'negspace': -32, 'top_space': -21},
+    {'negspace': -34, 'top_space': -24},
+)
+
+# lists in the configuration whose items can be left out to fit, e.g., `publication.cite_key`
+TRIM_PATHS = ('project', 'publication.cite_key')
+
+
+class AutoFitError(LaTEXCVMakerError):
+    pass
+
+
+def trim_order(config, trim_paths=TRIM_PATHS):
+    """Return the (path, index) of the items which can be left out, the lowest priority first.
+
+       An item (a mapping) can have a `priority` (0 by default), and otherwise the last items of
+       the lists go first, taking turns."""
+    items = []
+    for path in trim_paths:
+        value = config
+        for key in path.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if not isinstance(value, list):
+            continue
+        for i, item in enumerate(value):
+            priority = item.get('priority', 0) if isinstance(item, dict) else 0
+            items.append((priority, len(value) - 1 - i, path, i))
+    # `sorted` is stable, so the paths keep their order for items of the same priority and position
+    return [(path, i) for _, _, path, i in sorted(items, key=lambda item: item[:2])]
+
+
+def trim_config(config, removed):
+    """Return a copy of `config` without the items in `removed` (a set of (path, index)), which
+       only copies what it changes"""
+    paths = {}
+    for path, i in removed:
+        paths.setdefault(path, set()).add(i)
+    config = dict(config)
+    for path, indices in paths.items():
+        keys = path.split('.')
+        parent = config
+        for key in keys[:-1]:
+            parent[key] = dict(parent[key])
+            parent = parent[key]
+        parent[keys[-1]] = [item for i, item in enumerate(parent[keys[-1]]) if i not in indices]
+    return config
+
+
+def used_trim_paths(config, variant, trim_paths, temp_dir, strict=False):
+    """Return the paths of `trim_paths` which the templates of `variant` use, since leaving out the
+       items of the other ones makes no difference"""
+    from config_check import collect_usages
+    from latexcv import get_environment
+
+    templates = _resolve_variant(config, variant)[2]
+    usages, _ = collect_usages(get_environment(temp_dir, strict), templates)
+    used = set(usage.path[1:] for usage in usages)
+    return [path for path in trim_paths
+            if any(p[:len(path.split('.'))] == tuple(path.split('.')) for p in used)]
+
+
+def search_first(count, test, width=1):
+    """Return the first of `range(count)` for which `test` is true, or None, assuming that it is true
+       for all the following ones. `test` gets a list of (at most `width`) indices to test together
+       and returns their results, so each round narrows the range down by a factor of `width + 1`."""
+    lo, hi = 0, count
+    while lo < hi:
+        probes = sorted(set(lo + (hi - lo) * j // (width + 1) for j in range(1, width + 1)))
+        results = test(probes)
+        for probe, result in zip(probes, results):
+            if result:
+                hi = probe
+                break
+            lo = probe + 1
+    return hi if hi < count else None
+
+
+def search_richest(levels, spacings, test, width=1):
+    """Return the richest (trimmed, spacing) candidate for which `test` is true, or None, where
+       `trimmed` is the number of items left out (up to `levels - 1`) and `spacing` the index of the
+       spacing (the higher, the tighter). `test` gets a list of candidates and returns their results.
+
+       Whether a candidate fits is only monotone along each axis (leaving out more items, or
+       tightening the spacing), so first search the fewest items to leave out with the tightest
+       spacing, and then the loosest spacing with that many items left out."""
+    tightest = spacings - 1
+    trimmed = search_first(levels, lambda probes: test([(t, tightest) for t in probes]), width)
+    if trimmed is None:
+        return None
+    # the tightest spacing fits, so there is always a result
+    spacing = search_first(spacings, lambda probes: test([(trimmed, s) for s in probes]), width)
+    return trimmed, spacing
+
+
+def fit_pages(config, variant='cv_single.tex', max_pages=1,
+              temp_dir=os.path.join(PACKAGE_DIR, 'templates', 'default'), data_dir='bib', lib_dir='includes',
+              tool_dir=os.path.join(PACKAGE_DIR, 'tools'), build_cmds=None, trim_paths=TRIM_PATHS,
+              spacings=SPACINGS, jobs=4, strict=False, validate=True, resource_limits=None, verbose=False):
+    """Find the richest rendering of `variant` (see `render_tex`) which fits in `max_pages` pages.
+
+       A candidate leaves out the lowest-priority items (see `trim_order`) and uses one of `spacings`.
+       The fewest items to leave out, and then the loosest spacing, are found with `jobs`-ary searches
+       (see `search_richest`), compiling `jobs` candidates in parallel per round and reading their
+       page counts from the LaTeX logs.
+
+       Return a dict with the tex source, the PDF (bytes), the build report, the spacing, the items
+       left out (e.g., `project[2]`) and the number of compiles and rounds. Raise `AutoFitError` if
+       even the poorest candidate does not fit.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if max_pages < 1:
+        raise AutoFitError("Invalid number of pages: {0}".format(max_pages))
+    if validate:
+        # the candidates only leave out list items, so checking the full configuration is enough
+        render_tex(config, variant, temp_dir=temp_dir, strict=strict, validate=True)
+    order = trim_order(config, used_trim_paths(config, variant, trim_paths, temp_dir, strict))
+    steps = make_build_steps(build_cmds, tool_dir, verbose)
+    name = _resolve_variant(config, variant)[3]
+    # compiles per tex source, since different candidates can render the same tex
+    compiled = {}
+    digests = {}
+    stats = {'compiles': 0, 'rounds': 0}
+
+    def render(candidate):
+        trimmed, spacing = candidate
+        cv = trim_config(config, set(order[:trimmed]))
+        tex_source = render_tex(cv, variant, temp_dir=temp_dir, strict=strict, validate=False,
+                                fit=spacings[spacing])
+        digests[candidate] = hashlib.md5(tex_source.encode('utf-8')).hexdigest()
+        return digests[candidate], tex_source
+
+    def compile_one(tex_source):
+        return compile_tex(tex_source, name, steps, temp_dir=temp_dir, data_dir=data_dir, lib_dir=lib_dir,
+                           resource_limits=resource_limits, verbose=verbose)
+
+    def test(candidates):
+        stats['rounds'] += 1
+        pending = dict(rendered for rendered in map(render, candidates) if rendered[0] not in compiled)
+        if verbose:
+            print("Auto-fit round {0}: compiling candidate(s) {1}".format(stats['rounds'], candidates))
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(pending)))) as executor:
+            for digest, result in zip(pending, executor.map(compile_one, pending.values())):
+                compiled[digest] = (pending[digest],) + result
+        stats['compiles'] += len(pending)
+        return [fits(compiled[digests[c]]) for c in candidates]
+
+    def fits(result):
+        _, pdf, report = result
+        return pdf is not None and report['pages'] is not None and 0 < report['pages'] <= max_pages
+
+    found = search_richest(len(order) + 1, len(spacings), test, width=max(1, jobs))
+    if found is None:
+        raise AutoFitError("`{0}` does not fit in {1} page(s), even with the tightest spacing and without "
+                           "any of `{2}`".format(name, max_pages, ", ".join(trim_paths)))
+    trimmed, spacing = found
+    tex_source, pdf, report = compiled[digests[found]]
+    if verbose:
+        print("Auto-fit chose {0} item(s) left out and spacing {1} after {2} compile(s) in {3} round(s)".format(
+            trimmed, spacing, stats['compiles'], stats['rounds']))
+    return {
+        'tex': tex_source,
+        'pdf': pdf,
+        'report': report,
+        'spacing': spacings[spacing],
+        'trimmed': ['{0}[{1}]'.format(path, i) for path, i in sorted(order[:trimmed])],
+        'compiles': stats['compiles'],
+        'rounds': stats['rounds'],
+    }
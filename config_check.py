@@ -0,0 +1,320 @@
+from __future__ import print_function
+
+import difflib
+import threading
+import weakref
+
+import six
+from jinja2 import nodes, StrictUndefined, TemplateNotFound, TemplateSyntaxError
+
+# stands for "every item of a list" in a variable path, e.g. `cv.project[].name`
+ANY_ITEM = '[]'
+
+# filters which make an undefined variable harmless
+DEFAULT_FILTERS = ('default', 'd')
+
+
+class ConfigCheckError(Exception):
+    pass
+
+
+class GuardedStrictUndefined(StrictUndefined):
+    """Like `StrictUndefined`, an undefined variable fails as soon as it is printed or iterated over.
+       However, it is still false in `{% if %}` tests, and getting an attribute of it gives another
+       undefined variable, so that optional parts guarded by `{% if cv.some.thing %}` keep working."""
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+    def __getattr__(self, name):
+        if name[:2] == '__':
+            raise AttributeError(name)
+        return self
+
+    def __getitem__(self, name):
+        return self
+
+
+def format_path(path):
+    s = ''
+    for segment in path:
+        if isinstance(segment, int):
+            s += '[{0}]'.format(segment)
+        elif segment == ANY_ITEM:
+            s += ANY_ITEM
+        else:
+            s += ('.' if s else '') + segment
+    return s
+
+
+class VariableUsage:
+    """A variable path used by a template, with the paths which must be true for it to be used"""
+
+    def __init__(self, path, guards, template, lineno):
+        self.path = path
+        self.guards = guards
+        self.template = template
+        self.lineno = lineno
+
+
+class TemplateVariableCollector:
+    """Statically collect the paths of `root` variables, e.g. `cv.project[].name`, used by templates
+       (and the templates they include)."""
+
+    def __init__(self, env, root='cv'):
+        self.env = env
+        self.root = root
+        self.usages = []
+        self.problems = []
+        # the `uptodate` functions of the parsed templates (see `jinja2.BaseLoader.get_source`)
+        self.uptodate = []
+        self.__parsed = {}
+
+    def collect(self, template_name, guards=()):
+        """Collect the variables used by `template_name`, which is only rendered if all paths in
+           `guards` are true"""
+        self.__visit_template(template_name, {}, tuple(guards), ())
+        return self.usages
+
+    def __parse(self, template_name, ignore_missing=False):
+        if template_name not in self.__parsed:
+            try:
+                source, _, uptodate = self.env.loader.get_source(self.env, template_name)
+                self.uptodate.append(uptodate)
+                self.__parsed[template_name] = self.env.parse(source, template_name)
+            except TemplateNotFound:
+                if not ignore_missing:
+                    self.problems.append("Template `{0}` does not exist".format(template_name))
+                self.__parsed[template_name] = None
+            except TemplateSyntaxError as e:
+                self.problems.append("Syntax error in `{0}`, line {1}: {2}".format(template_name, e.lineno, e.message))
+                self.__parsed[template_name] = None
+        return self.__parsed[template_name]
+
+    def __visit_template(self, template_name, aliases, guards, including, ignore_missing=False):
+        if template_name in including:
+            return
+        ast = self.__parse(template_name, ignore_missing)
+        if ast is not None:
+            self.__visit_nodes(ast.body, aliases, guards, (template_name,) + including)
+
+    def __visit_nodes(self, node_list, aliases, guards, including):
+        for node in node_list:
+            self.__visit(node, aliases, guards, including)
+
+    def __resolve(self, node, aliases):
+        """Return the variable path of `node`, or None if it is not a (known) variable"""
+        if isinstance(node, nodes.Name):
+            if node.name in aliases:
+                return aliases[node.name]
+            return (self.root,) if node.name == self.root else None
+        if isinstance(node, nodes.Getattr):
+            path = self.__resolve(node.node, aliases)
+            return None if path is None else path + (node.attr,)
+        if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) and \
+                isinstance(node.arg.value, six.string_types):
+            path = self.__resolve(node.node, aliases)
+            return None if path is None else path + (node.arg.value,)
+        return None
+
+    def __test_paths(self, test, aliases):
+        # `find_all` only yields the descendants of `test`
+        candidates = [test] + list(test.find_all((nodes.Name, nodes.Getattr, nodes.Getitem)))
+        paths = [self.__resolve(n, aliases) for n in candidates]
+        return tuple(path for path in paths if path is not None)
+
+    def __visit(self, node, aliases, guards, including):
+        template = including[0]
+        if isinstance(node, (nodes.Name, nodes.Getattr, nodes.Getitem)):
+            path = self.__resolve(node, aliases)
+            if path is not None:
+                self.usages.append(VariableUsage(path, guards, template, node.lineno))
+                return
+        elif isinstance(node, nodes.For):
+            self.__visit(node.iter, aliases, guards, including)
+            iter_path = self.__resolve(node.iter, aliases)
+            body_aliases = dict(aliases)
+            if isinstance(node.target, nodes.Name):
+                if iter_path is not None:
+                    body_aliases[node.target.name] = iter_path + (ANY_ITEM,)
+                else:
+                    body_aliases.pop(node.target.name, None)
+            self.__visit_nodes(node.body, body_aliases, guards, including)
+            self.__visit_nodes(node.else_, aliases, guards, including)
+            return
+        elif isinstance(node, nodes.If):
+            # the variables in the test are optional, and guard the body
+            test_guards = self.__test_paths(node.test, aliases)
+            self.__visit_nodes(node.body, aliases, guards + test_guards, including)
+            for elif_ in getattr(node, 'elif_', []):
+                self.__visit(elif_, aliases, guards, including)
+            self.__visit_nodes(node.else_, aliases, guards, including)
+            return
+        elif isinstance(node, nodes.CondExpr):
+            self.__visit(node.expr1, aliases, guards + self.__test_paths(node.test, aliases), including)
+            if node.expr2 is not None:
+                self.__visit(node.expr2, aliases, guards, including)
+            return
+        elif isinstance(node, nodes.Filter) and node.name in DEFAULT_FILTERS:
+            return
+        elif isinstance(node, nodes.Test) and node.name in ('defined', 'undefined'):
+            return
+        elif isinstance(node, nodes.Assign) and isinstance(node.target, nodes.Name):
+            self.__visit(node.node, aliases, guards, including)
+            path = self.__resolve(node.node, aliases)
+            # `{% set %}` leaks to the rest of the scope, so the alias is updated in place
+            if path is not None:
+                aliases[node.target.name] = path
+            else:
+                aliases.pop(node.target.name, None)
+            return
+        elif isinstance(node, nodes.Include):
+            if isinstance(node.template, nodes.Const) and isinstance(node.template.value, six.string_types):
+                self.__visit_template(node.template.value, dict(aliases), guards, including, node.ignore_missing)
+            return
+        for child in node.iter_child_nodes():
+            self.__visit(child, aliases, guards, including)
+
+
+MISSING = object()
+
+
+def _get(value, segment):
+    if isinstance(segment, int):
+        return value[segment] if isinstance(value, list) and segment < len(value) else MISSING
+    if isinstance(value, dict):
+        return value.get(segment, MISSING)
+    return MISSING
+
+
+def _instances(value, path, prefix=()):
+    """Yield (concrete path, value) for each instance of `path`, expanding `ANY_ITEM`; the value is
+       MISSING if the path cannot be resolved (the concrete path then ends at the missing part)."""
+    if len(path) == 0:
+        yield prefix, value
+        return
+    segment = path[0]
+    if segment == ANY_ITEM:
+        if isinstance(value, list):
+            for i, item in enumerate(value):
+                for instance in _instances(item, path[1:], prefix + (i,)):
+                    yield instance
+        return
+    value = _get(value, segment)
+    if value is MISSING or value is None:
+        yield prefix + (segment,), MISSING
+        return
+    for instance in _instances(value, path[1:], prefix + (segment,)):
+        yield instance
+
+
+def _guard_holds(config, root, guard, usage_path, concrete_path):
+    """Whether `guard` is true for the instance `concrete_path` of `usage_path`. The list items in the
+       guard are bound to the items of the instance as long as the guard and the usage share their paths."""
+    value = {root: config}
+    bound = True
+    for i, segment in enumerate(guard):
+        bound = bound and i < len(usage_path) and usage_path[i] == segment
+        if segment == ANY_ITEM:
+            if not (bound and i < len(concrete_path)):
+                # the guard depends on a loop we cannot tell, so assume it is false
+                return False
+            segment = concrete_path[i]
+        value = _get(value, segment)
+        if value is MISSING:
+            return False
+    return bool(value)
+
+
+def check_config(config, usages, root='cv'):
+    """Check `config` against the variable usages of templates, and return all problems (a list of str)"""
+    problems = []
+    reported = set()
+    for usage in usages:
+        if usage.path[0] != root:
+            continue
+        for concrete_path, value in _instances({root: config}, usage.path):
+            if value is not MISSING or concrete_path in reported:
+                continue
+            if all(_guard_holds(config, root, guard, usage.path, concrete_path) for guard in usage.guards):
+                reported.add(concrete_path)
+                problems.append("`{0}` is undefined (used in `{1}`, line {2})".format(
+                    format_path(concrete_path), usage.template, usage.lineno))
+    return problems
+
+
+# collected usages per environment, reused as long as the templates do not change
+_usages_cache = weakref.WeakKeyDictionary()
+_usages_cache_lock = threading.Lock()
+
+
+def collect_usages(env, templates, root='cv'):
+    """Return the variable usages of the templates (see `check_templates`) and the problems found
+       while collecting them. The result is cached per environment until a template changes."""
+    key = (root, tuple(t if isinstance(t, six.string_types) else (t[0], tuple(t[1])) for t in templates))
+    with _usages_cache_lock:
+        cached = _usages_cache.setdefault(env, {}).get(key)
+    if cached is not None and all(uptodate is not None and uptodate() for uptodate in cached[0]):
+        return cached[1], cached[2]
+
+    collector = TemplateVariableCollector(env, root=root)
+    for template in templates:
+        if isinstance(template, six.string_types):
+            collector.collect(template)
+        else:
+            collector.collect(template[0], template[1])
+    with _usages_cache_lock:
+        _usages_cache[env][key] = (collector.uptodate, collector.usages, collector.problems)
+    return collector.usages, collector.problems
+
+
+def known_keys(env, root='cv', extensions=None):
+    """Return the top-level keys of `root` which the templates of `env` (those with one of
+       `extensions`, or all of them if None) use or test, or None if a template uses `root` as a
+       whole, in which case any key may be used"""
+    templates = env.list_templates(extensions=extensions)
+    usages, _ = collect_usages(env, templates, root=root)
+    keys = set()
+    for usage in usages:
+        if usage.path[0] != root:
+            continue
+        if len(usage.path) == 1 or usage.path[1] == ANY_ITEM:
+            return None
+        # the guards also contain the prefixes of the tested paths, e.g. `cv` for `cv.objective`
+        keys.update(guard[1] for guard in usage.guards if guard[0] == root and len(guard) > 1)
+        keys.add(usage.path[1])
+    return keys
+
+
+def check_keys(config, keys):
+    """Check that the top-level keys of `config` are in `keys`, and return all problems (a list of str)"""
+    problems = []
+    for key in sorted(config, key=str):
+        if key in keys:
+            continue
+        matches = difflib.get_close_matches(str(key), sorted(keys), n=1)
+        problems.append("`{0}` is an unknown key{1}".format(
+            key, " (did you mean `{0}`?)".format(matches[0]) if matches else ""))
+    return problems
+
+
+def check_templates(env, templates, config, root='cv', extensions=None):
+    """Check that `config` provides all variables the templates need before rendering them, and
+       raise `ConfigCheckError` with all problems found.
+
+       Each of `templates` is either a template name, or a pair of a template name and the paths
+       (e.g. `('cv', 'objective')`) which must be true for it to be rendered. A top-level key of
+       `config` which no template of `env` (see `known_keys`) refers to, e.g. a misspelled one, is
+       reported as well.
+    """
+    usages, problems = collect_usages(env, templates, root=root)
+    if not isinstance(config, dict):
+        raise ConfigCheckError("The configuration must be a mapping, but got `{0}`".format(type(config).__name__))
+    problems = problems + check_config(config, usages, root=root)
+    keys = known_keys(env, root=root, extensions=extensions)
+    if keys is not None:
+        problems += check_keys(config, keys)
+    if len(problems) > 0:
+        raise ConfigCheckError("\n".join(problems))
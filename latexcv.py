@@ -5,14 +5,16 @@ import argparse
 import os
 import shlex
 import sys
+import threading
 
 import six
-from jinja2 import Environment, FileSystemLoader
-from yaml import load
-from utility import ExternalCommandWrapper, \
-    FileRemoveWrapper, FileCopyWrapper, FileFilter, MakeDirWrapper, FileCopyError
+from utility import \
+    FileRemoveWrapper, FileCopyWrapper, FileFilter, MakeDirWrapper, FileCopyError, FileMoveWrapper
 from copy import deepcopy
 
+# NOTE: jinja2, yaml and the modules for compiling (e.g. `pipeline`) are imported in the methods
+#       which need them, so that `--help` and `--only-tex` do not pay for what they do not use.
+
 
 class LaTEXCVMakerError(Exception):
     pass
@@ -35,11 +37,32 @@ def is_cls_file(f):
     return is_certain_file(f, '.cls')
 
 
+TEX_TEMP_FILE_EXTS = (".blg", ".bbl", ".aux", ".log", ".brf", ".nlo", ".out", ".dvi", ".ps", ".lof", ".toc",
+                      ".fls", ".fdb_latexmk", ".pdfsync", ".synctex.gz", ".ind", ".ilg", ".idx")
+
+# ways of getting rid of the temporary files after compiling:
+#   unlink: remove them directly
+#   trash:  send them to trash
+#   cache:  move them into a per-target cache, which is restored before the next compile
+CLEANUP_POLICIES = ('unlink', 'trash', 'cache')
+
+CACHE_DIR = '.latexcv_cache'
+
+# sub-directory of CACHE_DIR for the compiled jinja2 templates
+JINJA2_CACHE_DIR = '.jinja2'
+
+
 def is_tex_temp_files(f):
-    temp_files_exts = {".blg", ".bbl", ".aux", ".log", ".brf", ".nlo", ".out", ".dvi", ".ps", ".lof", ".toc", ".fls",
-                       ".fdb_latexmk", ".pdfsync", ".synctex.gz", ".ind", ".ilg", ".idx"}
-    ext = os.path.splitext(f)[-1]
-    return ext in temp_files_exts
+    return f.endswith(TEX_TEMP_FILE_EXTS)
+
+
+def tex_temp_file_stem(f):
+    """Return the name of the target that the temporary file `f` belongs to, or None if `f`
+       is not a temporary file, e.g., `cv_single` for `cv_single.synctex.gz`"""
+    for ext in TEX_TEMP_FILE_EXTS:
+        if f.endswith(ext):
+            return f[:-len(ext)]
+    return None
 
 
 def split_filename(filename_or_path):
@@ -53,6 +76,114 @@ def split_filename(filename_or_path):
         return filename, path
 
 
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)).replace('\\', '/')
+
+DEFAULT_TEMPLATE = 'cv_multi.tex'
+
+# the extensions of the templates, which define the known configuration keys (see `validate_config`)
+TEMPLATE_EXTENSIONS = ('tex',)
+
+GENERATED_HEADER = "%% This file is generated by Jinja2"
+
+# jinja2 environments (and so the templates they compile) are kept for the lifetime of the process,
+# one per template directory and strictness
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def get_environment(temp_dir, strict=False, bytecode_dir=None, verbose=False):
+    """Return the jinja2 environment for the templates in `temp_dir` (and its sub-directories),
+       which is created on the first call and reused afterwards.
+
+       `bytecode_dir` only matters for the call creating the environment, whose compiled templates
+       are then also stored there for the next processes. The later calls share the templates
+       compiled in memory, whatever their `bytecode_dir`, so that, e.g., a maker per build directory
+       does not create an environment of its own."""
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+    from config_check import GuardedStrictUndefined
+
+    temp_dir = os.path.abspath(temp_dir).replace('\\', '/')
+    key = (temp_dir, strict)
+    with _environments_lock:
+        if key not in _environments:
+            search_path = [temp_dir]
+            for f in os.listdir(temp_dir):
+                if f.startswith('.'):
+                    continue
+                full_name = os.path.join(temp_dir, f).replace('\\', '/')
+                if os.path.isdir(full_name):
+                    search_path.append(full_name)
+            if verbose:
+                print("Adding `{0}` to jinja2's template file system".format(";".join(search_path)))
+            options = {'undefined': GuardedStrictUndefined} if strict else {}
+            if bytecode_dir is not None:
+                if not os.path.isdir(bytecode_dir):
+                    os.makedirs(bytecode_dir)
+                options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_dir)
+            _environments[key] = Environment(loader=FileSystemLoader(search_path), trim_blocks=True, **options)
+        return _environments[key]
+
+
+def load_config(config_file):
+    """Load the YAML configuration file"""
+    from yaml import load
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+
+    with open(config_file, 'r') as f:
+        return load(f, Loader=SafeLoader)
+
+
+def variant_templates(variant):
+    """Return the templates to check (see `config_check.check_templates`) for a variant"""
+    # a section is only rendered if its configuration is not empty
+    return [variant['template']] + [(section['template'], [('cv', section['key'])])
+                                    for section in variant['sections']]
+
+
+def validate_config(j2_env, config, templates, what='the configuration'):
+    """Check the configuration against the variables used by the templates, and report all
+       problems at once before rendering anything"""
+    from config_check import ConfigCheckError, check_templates
+
+    try:
+        check_templates(j2_env, templates, config, extensions=TEMPLATE_EXTENSIONS)
+    except ConfigCheckError as e:
+        raise LaTEXCVMakerError("Invalid configuration {0}:\n".format(what) + str(e))
+
+
+def make_build_steps(build_cmds=None, tool_dir='tools', verbose=False):
+    """Return the `BuildStep`s for custom build commands, or the built-in ones if `build_cmds` is None"""
+    from pipeline import BuildStep, BuildPipelineError, LATEXRUN_OBJ_DIR, parse_build_step
+
+    if build_cmds is not None:
+        try:
+            return [parse_build_step(s) for s in build_cmds]
+        except BuildPipelineError as e:
+            raise LaTEXCVMakerError(str(e))
+
+    if verbose:
+        print("Since you did not provide custom build command, the default one will be used!")
+    if not os.path.isabs(tool_dir):
+        tool_dir = os.path.abspath(tool_dir)
+    steps = []
+    if sys.platform == "linux" or sys.platform == "linux2" or sys.platform == "darwin":
+        if verbose:
+            print("You are using unix-based OS, we will try to use texliveonfly script to automatically "
+                  "download LaTeX dependencies.")
+        command = ['python3', '{0}{1}texliveonfly.py'.format(tool_dir, os.sep), '$file']
+        # tlmgr must not install packages for several tex files compiled in parallel at the same time
+        steps.append(BuildStep(command, exclusive=True))
+    # each tex file gets its own latexrun output directory, so that they can be compiled in parallel
+    tex_build_command = shlex.split(
+        'python3 "{tool_dir}{sep}latexrun{sep}latexrun" -O {obj_dir}/$file_base_name $file'.format(
+            tool_dir=tool_dir, sep=os.sep, obj_dir=LATEXRUN_OBJ_DIR))
+    steps.append(BuildStep(tex_build_command))
+    return steps
+
+
 class LaTeXCVMaker:
     """A simple class for making CV."""
 
@@ -66,6 +197,17 @@ class LaTeXCVMaker:
                  tool_dir='tools',
                  only_tex=False,
                  delete_temp=True,
+                 cleanup='trash',
+                 write_report=False,
+                 validate=True,
+                 strict=False,
+                 variants=None,
+                 jobs=1,
+                 resource_limits=None,
+                 spool_dir=None,
+                 spool_timeout=None,
+                 fit_pages=None,
+                 fit_trim=None,
                  verbose=False,
                  **kwargs):
         self.temp_dir = temp_dir
@@ -78,10 +220,28 @@ class LaTeXCVMaker:
         self.tool_dir = tool_dir
         self.only_tex = only_tex
         self.delete_temp = delete_temp
+        assert cleanup in CLEANUP_POLICIES
+        self.cleanup = cleanup
+        self.write_report = write_report
+        self.validate = validate
+        self.strict = strict
+        self.variants = variants
+        assert jobs >= 1
+        self.jobs = jobs
+        # resource limits of each build command, e.g., {'cpu_time': 60, 'memory': 2 << 30}
+        self.resource_limits = resource_limits
+        # compile by the workers of a spool directory (see `workqueue.py`) instead of locally
+        self.spool_dir = spool_dir
+        self.spool_timeout = spool_timeout
+        # auto-fit each tex file in so many pages (see `autofit.py`), leaving out items of `fit_trim`
+        assert fit_pages is None or fit_pages >= 1
+        self.fit_pages = fit_pages
+        self.fit_trim = fit_trim
         self.verbose = verbose
         self.kwargs = kwargs
 
         self.build_cmds = []
+        self.reports = {}
 
     def __do_preparations(self):
         # make build directory a absolute path
@@ -91,8 +251,9 @@ class LaTeXCVMaker:
 
         # process template filename(s) and tex filename(s) to make sure they do not contain paths
         if isinstance(self.temp_files, list) or isinstance(self.temp_files, tuple):
-            assert (isinstance(self.tex_files, list) or isinstance(self.tex_files, tuple)) and \
-                   len(self.tex_files) == len(self.temp_files)
+            assert (self.tex_files is None) or \
+                   ((isinstance(self.tex_files, list) or isinstance(self.tex_files, tuple)) and
+                    len(self.tex_files) == len(self.temp_files))
             filenames = []
             for temp_file in self.temp_files:
                 fname, path = split_filename(temp_file)
@@ -125,6 +286,7 @@ class LaTeXCVMaker:
             mkdir.mkdir(self.build_dir)
         else:
             assert os.path.isdir(self.build_dir)
+        self.cache_dir = os.path.join(self.build_dir, CACHE_DIR).replace('\\', '/')
         #   step 2: copy dependencies to build directory
         try:
             cp = FileCopyWrapper(verbose=self.verbose)
@@ -140,41 +302,43 @@ class LaTeXCVMaker:
             print("Failed to copy dependent files: " + str(e))
             print("We assume that you have already copied tem manually")
 
-        # prepare build commands
-        if 'build_cmds' in self.kwargs and (self.kwargs['build_cmds'] is not None):
-            self.build_cmds = self.kwargs['build_cmds']
-            # self.build_cmds = [shlex.split(s) for s in self.build_cmds]
-        else:
-            if self.verbose:
-                print("Since you did not provide custom build command, the default one will be used!")
-            if not os.path.isabs(self.tool_dir):
-                self.tool_dir = os.path.abspath(self.tool_dir)
-            if sys.platform == "linux" or sys.platform == "linux2" or sys.platform == "darwin":
-                if self.verbose:
-                    print("You are using unix-based OS, we will try to use texliveonfly script to automatically "
-                          "download LaTeX dependencies.")
-                command = ['python3', '"{0}{1}texliveonfly.py"'.format(self.tool_dir, os.sep)]
-                self.build_cmds.append(command)
-            tex_build_command = shlex.split(
-                'python3 "{tool_dir}{sep}latexrun{sep}latexrun"'.format(tool_dir=self.tool_dir, sep=os.sep))
-            self.build_cmds.append(tex_build_command)
+    def __prepare_build_cmds(self):
+        self.build_cmds = make_build_steps(self.kwargs.get('build_cmds'), self.tool_dir, self.verbose)
+
+    def __config_name(self):
+        if isinstance(self.config_file, dict):
+            return "the configuration"
+        return "`{0}`".format(self.config_file)
 
     def make_tex(self):
         """Generate tex code"""
+        from jinja2 import TemplateError
+        from yaml import YAMLError
+        from variants import VariantError, load_variants
+
         self.__do_preparations()
         try:
-            temp_dir = [self.temp_dir]
-            for f in os.listdir(self.temp_dir):
-                if f.startswith('.'):
-                    continue
-                full_name = os.path.join(self.temp_dir, f).replace('\\', '/')
-                if os.path.isdir(full_name):
-                    temp_dir.append(full_name)
-            if self.verbose:
-                print("Adding `{0}` to jinja2's template file system".format(";".join(temp_dir)))
-            j2_env = Environment(loader=FileSystemLoader(temp_dir),
-                                 trim_blocks=True)
-            config = load(open(self.config_file, 'r'))
+            # compiled templates are cached across runs
+            bytecode_dir = os.path.join(self.cache_dir, JINJA2_CACHE_DIR).replace('\\', '/')
+            j2_env = get_environment(self.temp_dir, self.strict, bytecode_dir, self.verbose)
+            if isinstance(self.config_file, dict):
+                config = self.config_file
+            else:
+                config = load_config(self.config_file)
+
+            try:
+                variants = load_variants(config, self.variants)
+            except VariantError as e:
+                raise LaTEXCVMakerError("Invalid variants in {0}: ".format(self.__config_name()) + str(e))
+            if variants is not None:
+                self.__make_variants(j2_env, variants)
+                return
+
+            if self.validate:
+                if isinstance(self.temp_files, six.string_types):
+                    self.__validate(j2_env, config, [self.temp_files])
+                else:
+                    self.__validate(j2_env, config, self.temp_files)
 
             if isinstance(self.temp_files, list) or isinstance(self.temp_files, tuple):
                 for temp_file, tex_file in zip(self.temp_files, self.tex_files):
@@ -184,58 +348,390 @@ class LaTeXCVMaker:
                 assert isinstance(self.temp_files, six.string_types)
                 tex_source = j2_env.get_template(self.temp_files).render({'cv': config})
                 self.__make_tex_file(self.tex_files, tex_source)
-        except OSError as e:
+        except (OSError, YAMLError, TemplateError) as e:
             raise LaTEXCVMakerError("Failed to make cv: " + str(e))
 
-    def __make_tex_file(self, filename, tex_source):
-        add_msg = "%% This file is generated by Jinja2"
+    def __make_variants(self, j2_env, variants):
+        """Render all variants declared in the configuration, which share the loaded configuration
+           and the compiled templates"""
+        if self.verbose:
+            print("Making variant(s) `{0}`".format(", ".join(variant['name'] for variant, _ in variants)))
+        if self.validate:
+            for variant, cv in variants:
+                self.__validate(j2_env, cv, variant_templates(variant), variant['name'])
+        for variant, cv in variants:
+            tex_source = j2_env.get_template(variant['template']).render({'cv': cv, 'variant': variant})
+            self.__make_tex_file(variant['tex_file'], tex_source)
+
+    def __validate(self, j2_env, config, templates, variant=None):
+        what = self.__config_name()
+        if variant is not None:
+            what += " (variant `{0}`)".format(variant)
+        if self.verbose:
+            print("Checking {0}".format(what))
+        validate_config(j2_env, config, templates, what)
 
+    def __make_tex_file(self, filename, tex_source):
         filename = os.path.join(self.build_dir, filename).replace('\\', '/')
         try:
             with open(filename, 'w') as texf:
-                texf.write("%s\n" % add_msg)
+                texf.write("%s\n" % GENERATED_HEADER)
                 texf.write(tex_source)
         except OSError as e:
             raise LaTEXCVMakerError("Failed to create tex file `{0}`: ".format(filename) + str(e))
 
-    def __make_pdf(self):
+    def __prepare_pdf(self):
+        """Prepare the build commands and return the tex files to compile"""
+        self.__prepare_build_cmds()
         ff = FileFilter(category='inclusive', verbose=self.verbose)
-        for file in ff.filter(os.listdir(self.build_dir), [is_tex_file]):
-            self.__make_single_pdf(file)
+        return ff.filter(os.listdir(self.build_dir), [is_tex_file])
+
+    def __make_pdf(self):
+        tex_files = self.__prepare_pdf()
+        if self.jobs > 1 and len(tex_files) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                # iterate over the results to raise the first error (if any)
+                for _ in executor.map(self.__make_single_pdf, tex_files):
+                    pass
+        else:
+            for file in tex_files:
+                self.__make_single_pdf(file)
+
+    def __make_pdf_distributed(self):
+        """Publish a compile job per tex file to the spool directory, and wait for the workers to
+           publish the PDFs and build reports back"""
+        import json
+        import shutil
+        import time
+        from workqueue import SpoolQueue, WorkQueueError
+
+        tex_files = self.__prepare_pdf()
+        # the dependencies copied to the build directory, e.g., `bib` and `includes`
+        dependencies = [os.path.join(self.build_dir, os.path.basename(d)).replace('\\', '/')
+                        for d in (self.data_dir, self.lib_dir) if d is not None]
+        dependencies = [d for d in dependencies if os.path.exists(d)]
+        jobs = {}
+        try:
+            queue = SpoolQueue(self.spool_dir, verbose=self.verbose)
+            for tex_file in tex_files:
+                spec = {'tex_file': tex_file, 'build_cmds': self.kwargs.get('build_cmds'),
+                        'limits': self.resource_limits}
+                tex_path = os.path.join(self.build_dir, tex_file).replace('\\', '/')
+                jobs[queue.submit(spec, [tex_path] + dependencies)] = tex_file
+            if self.verbose:
+                print("Waiting for the workers of `{0}` to compile {1} tex file(s)".format(self.spool_dir, len(jobs)))
+
+            start = time.time()
+            while len(jobs) > 0:
+                # also recover the jobs of dead workers, in case no other worker is alive
+                queue.recover()
+                for job_id, tex_file in list(jobs.items()):
+                    status = queue.status(job_id)
+                    if status == 'failed':
+                        raise LaTEXCVMakerError("Failed to compile `{0}`: {1}".format(tex_file, queue.error(job_id)))
+                    if status != 'done':
+                        continue
+                    tex_path = os.path.join(self.build_dir, tex_file).replace('\\', '/')
+                    report = None
+                    outputs = queue.outputs(job_id)
+                    if not any(is_pdf_file(output) for output in outputs):
+                        raise LaTEXCVMakerError("Failed to compile `{0}`: no PDF was published".format(tex_file))
+                    for output in outputs:
+                        if output.endswith('.report.json'):
+                            with open(output, 'r') as f:
+                                report = json.load(f)
+                        else:
+                            # the spool is usually on another file system (e.g., NFS) than the build directory
+                            shutil.move(output, os.path.join(self.build_dir, os.path.basename(output)))
+                    if report is not None:
+                        report['target'] = tex_path
+                        self.__end_single_pdf(tex_path, report)
+                    queue.remove(job_id)
+                    del jobs[job_id]
+                if len(jobs) > 0:
+                    if self.spool_timeout is not None and time.time() - start > self.spool_timeout:
+                        raise LaTEXCVMakerError("Timed out waiting for the workers of `{0}` to compile {1}".format(
+                            self.spool_dir, ", ".join(sorted(jobs.values()))))
+                    time.sleep(0.2)
+        except (OSError, ValueError, WorkQueueError) as e:
+            raise LaTEXCVMakerError("Failed to compile with the workers of `{0}`: ".format(self.spool_dir) + str(e))
+        finally:
+            for job_id in jobs:
+                queue.remove(job_id)
 
     def __make_single_pdf(self, tex_file):
+        from pipeline import BuildPipelineError
+
+        tex_file, pipeline = self.__begin_single_pdf(tex_file)
+        try:
+            report = pipeline.run(tex_file)
+        except BuildPipelineError as e:
+            raise LaTEXCVMakerError("Failed to compile `{0}`: ".format(tex_file) + str(e))
+        self.__end_single_pdf(tex_file, report)
+
+    def __begin_single_pdf(self, tex_file):
+        """Return the full path of `tex_file` and the pipeline to build it"""
+        from pipeline import BuildPipeline
+
+        if self.cleanup == 'cache':
+            self.__restore_temporary(os.path.splitext(tex_file)[0])
         tex_file = os.path.join(self.build_dir, tex_file).replace('\\', '/')
         if self.verbose:
             print("Compiling `{0}`".format(tex_file))
-        if ('build_cmds' not in self.kwargs) or (self.kwargs['build_cmds'] is None):
-            for cmd in self.build_cmds:
-                cmd_ = ExternalCommandWrapper(cmd=cmd[0], cmd_args=cmd[1:] + [tex_file], cwd=self.build_dir,
-                                              verbose=self.verbose)
-                cmd_.run()
+        return tex_file, BuildPipeline(self.build_cmds, cwd=self.build_dir, state_dir=self.cache_dir,
+                                       limits=self.resource_limits, verbose=self.verbose)
+
+    def __end_single_pdf(self, tex_file, report):
+        self.reports[os.path.basename(tex_file)] = report
+        if self.write_report:
+            report_file = os.path.splitext(tex_file)[0] + '.report.json'
+            try:
+                with open(report_file, 'w') as f:
+                    f.write(self.report(tex_file))
+            except OSError as e:
+                raise LaTEXCVMakerError("Failed to create report `{0}`: ".format(report_file) + str(e))
+
+    def report(self, tex_file):
+        """Return the build report of `tex_file` in JSON, which contains the errors, missing files/fonts,
+           overfull/underfull boxes, rerun hint and page count from the LaTeX log, and the time spent
+           in each build command"""
+        import json
+
+        tex_file = os.path.basename(tex_file)
+        if tex_file not in self.reports:
+            raise LaTEXCVMakerError("`{0}` has not been compiled".format(tex_file))
+        return json.dumps(self.reports[tex_file], indent=2, sort_keys=True)
+
+    def make_fitted(self):
+        """Generate and compile the richest rendering of each tex file which fits in `self.fit_pages`
+           pages (see `autofit.fit_pages`)"""
+        from yaml import YAMLError
+        from autofit import TRIM_PATHS, fit_pages
+        from variants import VariantError, load_variants
+
+        self.__do_preparations()
+        try:
+            if isinstance(self.config_file, dict):
+                config = self.config_file
+            else:
+                config = load_config(self.config_file)
+            variants = load_variants(config, self.variants)
+        except (OSError, YAMLError) as e:
+            raise LaTEXCVMakerError("Failed to make cv: " + str(e))
+        except VariantError as e:
+            raise LaTEXCVMakerError("Invalid variants in {0}: ".format(self.__config_name()) + str(e))
+        if variants is not None:
+            targets = [(variant['name'], variant['tex_file']) for variant, _ in variants]
+        elif isinstance(self.temp_files, six.string_types):
+            targets = [(self.temp_files, self.tex_files)]
         else:
-            build_cmds = [(s.replace('$file', '"' + tex_file + '"')) for s in self.build_cmds]
-            build_cmds = [shlex.split(s) for s in build_cmds]
-            for cmd in build_cmds:
-                cmd_ = ExternalCommandWrapper(cmd=cmd[0], cmd_args=cmd[1:], cwd=self.build_dir,
-                                              verbose=self.verbose)
-                cmd_.run()
+            targets = list(zip(self.temp_files, self.tex_files))
+
+        for variant, tex_file in targets:
+            if self.verbose:
+                print("Fitting `{0}` in {1} page(s)".format(tex_file, self.fit_pages))
+            result = fit_pages(config, variant, self.fit_pages, temp_dir=self.temp_dir, data_dir=self.data_dir,
+                               lib_dir=self.lib_dir, tool_dir=self.tool_dir, build_cmds=self.kwargs.get('build_cmds'),
+                               trim_paths=self.fit_trim or TRIM_PATHS, jobs=self.jobs, strict=self.strict,
+                               validate=self.validate, resource_limits=self.resource_limits, verbose=self.verbose)
+            tex_path = os.path.join(self.build_dir, tex_file).replace('\\', '/')
+            pdf_path = os.path.splitext(tex_path)[0] + '.pdf'
+            try:
+                with open(tex_path, 'w') as texf:
+                    texf.write(result['tex'])
+                with open(pdf_path, 'wb') as pdff:
+                    pdff.write(result['pdf'])
+            except OSError as e:
+                raise LaTEXCVMakerError("Failed to save `{0}`: ".format(tex_path) + str(e))
+            report = dict(result['report'], target=tex_path)
+            report['fit'] = dict((k, result[k]) for k in ('spacing', 'trimmed', 'compiles', 'rounds'))
+            self.__end_single_pdf(tex_path, report)
+            if self.verbose or len(result['trimmed']) > 0:
+                print("`{0}` fits in {1} page(s) without `{2}`".format(
+                    tex_file, self.fit_pages, ", ".join(result['trimmed']) or "nothing"))
 
     def make_all(self):
+        if self.fit_pages is not None:
+            self.make_fitted()
+            return
         self.make_tex()
         if not self.only_tex:
-            self.__make_pdf()
+            if self.spool_dir is not None:
+                self.__make_pdf_distributed()
+            else:
+                self.__make_pdf()
             if self.delete_temp:
                 self.__delete_temporary()
 
     def make(self):
         self.make_all()
 
+    async def make_async(self, semaphore=None):
+        """Like `make`, but to be awaited in an event loop: rendering and file operations run in the
+           default executor, and the build commands in asyncio subprocesses, at most `self.jobs` of
+           them at the same time (or as many as `semaphore`, an `asyncio.Semaphore`, allows, which can
+           be shared by several makers). Cancelling it, or a failed build, kills the running build
+           commands."""
+        import asyncio
+        from pipeline import BuildPipelineError
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.make_tex)
+        if self.only_tex:
+            return
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.jobs)
+
+        async def make_single_pdf(tex_file):
+            tex_file, pipeline = await loop.run_in_executor(None, self.__begin_single_pdf, tex_file)
+            try:
+                report = await pipeline.run_async(tex_file, semaphore)
+            except BuildPipelineError as e:
+                raise LaTEXCVMakerError("Failed to compile `{0}`: ".format(tex_file) + str(e))
+            await loop.run_in_executor(None, self.__end_single_pdf, tex_file, report)
+
+        tex_files = await loop.run_in_executor(None, self.__prepare_pdf)
+        tasks = [asyncio.ensure_future(make_single_pdf(tex_file)) for tex_file in tex_files]
+        try:
+            # on the first failure (or if cancelled), cancel the other builds and wait for their commands
+            # to be killed before raising
+            if tasks:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        if self.delete_temp:
+            await loop.run_in_executor(None, self.__delete_temporary)
+
     def __delete_temporary(self):
-        ff = FileFilter(category='inclusive', verbose=self.verbose)
-        rm = FileRemoveWrapper(verbose=self.verbose)
-        rm_files = [os.path.join(self.build_dir, f).replace('\\', '/') for f in ff.filter(os.listdir(self.build_dir),
-                                                                                          [is_tex_temp_files])]
-        rm.remove(rm_files)
+        temp_files = {}
+        for f in os.listdir(self.build_dir):
+            stem = tex_temp_file_stem(f)
+            if stem is not None:
+                temp_files.setdefault(stem, []).append(os.path.join(self.build_dir, f).replace('\\', '/'))
+        if self.cleanup == 'cache':
+            mv = FileMoveWrapper(verbose=self.verbose)
+            for stem, files in temp_files.items():
+                mv.move(files, os.path.join(self.cache_dir, stem))
+        else:
+            rm = FileRemoveWrapper(trash=(self.cleanup == 'trash'), verbose=self.verbose)
+            rm.remove([f for files in temp_files.values() for f in files])
+
+    def __restore_temporary(self, stem):
+        """Move the cached temporary files of `stem` back to the build directory, so that
+           LaTeX can start from the results of the last compile"""
+        stem_cache_dir = os.path.join(self.cache_dir, stem)
+        if not os.path.isdir(stem_cache_dir):
+            return
+        mv = FileMoveWrapper(verbose=self.verbose)
+        mv.move([os.path.join(stem_cache_dir, f).replace('\\', '/') for f in os.listdir(stem_cache_dir)],
+                self.build_dir)
+
+
+def _resolve_variant(config, variant):
+    """Return the template, the rendering context, the templates to check and the name of `variant`,
+       which is either a variant declared in the configuration, a template name or a variant declaration"""
+    from variants import VariantError, base_config, load_variants, make_variant
+
+    if not isinstance(config, dict):
+        raise LaTEXCVMakerError("The configuration must be a dict")
+    try:
+        if isinstance(variant, dict):
+            variant, cv = make_variant(variant, base_config(config))
+            return variant['template'], {'cv': cv, 'variant': variant}, variant_templates(variant), variant['name']
+        declared = load_variants(config) or []
+        if variant is None:
+            if len(declared) == 0:
+                variant = DEFAULT_TEMPLATE
+            else:
+                variant = declared[0][0]['name']
+        for v, cv in declared:
+            if v['name'] == variant:
+                return v['template'], {'cv': cv, 'variant': v}, variant_templates(v), v['name']
+    except VariantError as e:
+        raise LaTEXCVMakerError("Invalid variants: " + str(e))
+    return variant, {'cv': base_config(config)}, [variant], os.path.splitext(variant)[0]
+
+
+def render_tex(config, variant=None, temp_dir=os.path.join(PACKAGE_DIR, 'templates', 'default'),
+               strict=False, validate=True, fit=None):
+    """Render a CV from `config` (a dict, e.g., the loaded `_config.yaml`) and return the tex source.
+
+       `variant` is the name of a variant declared in `config`, a template name (e.g., `cv_single.tex`),
+       or a variant declaration (a dict, see `variants.load_variants`). By default, the first declared
+       variant, or `cv_multi.tex` if there is none, is rendered. `fit` are the spacing parameters
+       (see `autofit.SPACINGS`) which the template gets as `fit`.
+
+       Nothing is written to the file system, and the jinja2 environment of `temp_dir` is shared by
+       all calls (in the same process).
+    """
+    from jinja2 import TemplateError
+
+    template, context, templates, name = _resolve_variant(config, variant)
+    if fit is not None:
+        context['fit'] = fit
+    try:
+        j2_env = get_environment(temp_dir, strict)
+        if validate:
+            validate_config(j2_env, context['cv'], templates, "(variant `{0}`)".format(name))
+        return "%s\n" % GENERATED_HEADER + j2_env.get_template(template).render(context)
+    except (OSError, TemplateError) as e:
+        raise LaTEXCVMakerError("Failed to make cv: " + str(e))
+
+
+def build_pdf(config, variant=None, temp_dir=os.path.join(PACKAGE_DIR, 'templates', 'default'),
+              data_dir='bib', lib_dir='includes', tool_dir=os.path.join(PACKAGE_DIR, 'tools'),
+              build_cmds=None, strict=False, validate=True, resource_limits=None, verbose=False):
+    """Render a CV from `config` (see `render_tex`), compile it in a temporary directory and return
+       the PDF (bytes). `data_dir` and `lib_dir` are relative to `temp_dir`, `build_cmds` are the
+       custom build commands (see `--build-cmds`) and `resource_limits` those of each of them (see
+       `LaTeXCVMaker`)."""
+    tex_source = render_tex(config, variant, temp_dir=temp_dir, strict=strict, validate=validate)
+    name = _resolve_variant(config, variant)[3]
+    steps = make_build_steps(build_cmds, tool_dir, verbose)
+    pdf, report = compile_tex(tex_source, name, steps, temp_dir=temp_dir, data_dir=data_dir, lib_dir=lib_dir,
+                              resource_limits=resource_limits, verbose=verbose)
+    if pdf is None:
+        errors = "; ".join(error['message'] for error in report['errors'])
+        raise LaTEXCVMakerError("Failed to compile `{0}`{1}".format(name, (": " + errors) if errors else ""))
+    return pdf
+
+
+def compile_tex(tex_source, name, steps, temp_dir=os.path.join(PACKAGE_DIR, 'templates', 'default'),
+                data_dir='bib', lib_dir='includes', resource_limits=None, verbose=False):
+    """Compile `tex_source` as `<name>.tex` with the build steps `steps` (see `make_build_steps`) in a
+       temporary directory, and return the PDF (bytes, or None if LaTeX made none) and the build report"""
+    import shutil
+    import tempfile
+    from pipeline import BuildPipeline, BuildPipelineError
+
+    build_dir = tempfile.mkdtemp(prefix='latexcv-').replace('\\', '/')
+    try:
+        cp = FileCopyWrapper(verbose=verbose)
+        for dependency_dir in (data_dir, lib_dir):
+            if dependency_dir is not None:
+                cp.copy(os.path.join(os.path.abspath(temp_dir), dependency_dir).replace('\\', '/'), build_dir)
+        tex_file = os.path.join(build_dir, name + '.tex').replace('\\', '/')
+        with open(tex_file, 'w') as texf:
+            texf.write(tex_source)
+        try:
+            report = BuildPipeline(steps, cwd=build_dir, limits=resource_limits, verbose=verbose).run(tex_file)
+        except BuildPipelineError as e:
+            raise LaTEXCVMakerError("Failed to compile `{0}`: ".format(tex_file) + str(e))
+        pdf_file = os.path.join(build_dir, name + '.pdf')
+        if not os.path.exists(pdf_file):
+            return None, report
+        with open(pdf_file, 'rb') as f:
+            return f.read(), report
+    except (OSError, FileCopyError) as e:
+        raise LaTEXCVMakerError("Failed to make cv: " + str(e))
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
 
 
 def arg_parser_shlex(s):
@@ -249,6 +745,17 @@ def arg_parser_shlex(s):
         raise argparse.ArgumentTypeError(str(e))
 
 
+def arg_parser_positive_int(s):
+    """Argument parser for positive integers, e.g., the number of jobs"""
+    try:
+        value = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: `{0}`".format(s))
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, but got {0}".format(value))
+    return value
+
+
 def main():
     # Parse the command line
     arg_parser = argparse.ArgumentParser(
@@ -282,14 +789,58 @@ def main():
     arg_parser.add_argument(
         '--tool-dir', metavar='DIR', dest='tool_dir', default='tools',
         help='Directory to store customized LaTeX compiling scripts (default: `tools`)')
+    arg_parser.add_argument(
+        '--variant', nargs='*', metavar='NAME', dest='variants',
+        help='Variant(s) declared under `variants` in the configuration file to make (default: all of them)')
+    arg_parser.add_argument(
+        '-j', '--jobs', metavar='N', type=arg_parser_positive_int, dest='jobs', default=1,
+        help='Number of tex files to compile in parallel (default: 1)')
+    arg_parser.add_argument(
+        '--cpu-time', metavar='SECONDS', type=int, dest='cpu_time',
+        help='Limit the CPU time of each build command (POSIX only)')
+    arg_parser.add_argument(
+        '--memory', metavar='MB', type=int, dest='memory',
+        help='Limit the memory (address space) of each build command in megabytes (POSIX only)')
+    arg_parser.add_argument(
+        '--spool-dir', metavar='DIR', dest='spool_dir',
+        help='Compile by the workers (`python3 workqueue.py DIR`) of this (shared) spool directory '
+             'instead of locally')
+    arg_parser.add_argument(
+        '--spool-timeout', metavar='SECONDS', type=float, dest='spool_timeout',
+        help='Give up if the workers have not compiled all tex files in time (default: wait forever)')
+    arg_parser.add_argument(
+        '--fit-pages', metavar='N', type=arg_parser_positive_int, dest='fit_pages',
+        help='Auto-fit each CV in N pages, by tightening the spacing and leaving out the lowest-priority '
+             'items, compiling up to `--jobs` candidates in parallel')
+    arg_parser.add_argument(
+        '--fit-trim', nargs='*', metavar='PATH', dest='fit_trim',
+        help='Lists in the configuration whose items can be left out by `--fit-pages` '
+             '(default: `project publication.cite_key`)')
     arg_parser.add_argument(
         '--not-delete-temp', action='store_true', dest='not_delete_temp', help='Not to delete temporary file(s).')
+    arg_parser.add_argument(
+        '--cleanup', metavar='POLICY', choices=CLEANUP_POLICIES, dest='cleanup', default='trash',
+        help='How to delete temporary file(s): `unlink` removes them directly, `trash` sends them to trash, '
+             'and `cache` keeps them in a per-target cache under the build directory so that the next '
+             'compile converges faster (default: `trash`)')
     arg_parser.add_argument(
         '--build-cmds', metavar='ARGS', type=arg_parser_shlex, nargs='*', dest='build_cmds',
         help='Custom LaTeX build commands, which will be parsed and split using POSIX shell rules. '
              '(We are trying to mimic the build systems of sublime text 3, but currently we only support '
-             'very few features of it. More details can be found in README.md.)'
+             'very few features of it. A command prefixed with `@bib` runs only if the bibliography changed, '
+             'and one prefixed with `@rerun[=N]` reruns while LaTeX asks for it. More details can be found '
+             'in README.md.)'
     )
+    arg_parser.add_argument(
+        '--no-validate', action='store_true', dest='no_validate',
+        help='Not to check the configuration against the variables used by the template(s) before making CV(s)')
+    arg_parser.add_argument(
+        '--strict', action='store_true', dest='strict',
+        help='Fail when a template prints or loops over an undefined variable, instead of rendering it as empty')
+    arg_parser.add_argument(
+        '--report', action='store_true', dest='write_report',
+        help='Write a build report (diagnostics from the LaTeX log and timings) in JSON to '
+             '`<tex-file>.report.json` for each compiled tex file')
     arg_parser.add_argument(
         '--only-tex', action='store_true', dest='only_tex', help='Only to generate tex (not to compile to PDF(s))'
     )
@@ -298,12 +849,19 @@ def main():
 
     args = arg_parser.parse_args()
     delete_temp = not args.not_delete_temp
+    resource_limits = None
+    if args.cpu_time or args.memory:
+        resource_limits = {'cpu_time': args.cpu_time, 'memory': args.memory << 20 if args.memory else None}
 
     cv_maker = LaTeXCVMaker(
         temp_dir=args.temp_dir, temp_files=args.temp_files, tex_files=args.tex_files,
         cv_config=args.config_file, build_dir=args.build_dir, data_dir=args.data_dir,
         lib_dir=args.lib_dir, tool_dir=args.tool_dir, delete_temp=delete_temp,
-        only_tex=args.only_tex, verbose=args.verbose, build_cmds=args.build_cmds
+        cleanup=args.cleanup, write_report=args.write_report, validate=not args.no_validate,
+        strict=args.strict, variants=args.variants, jobs=args.jobs, resource_limits=resource_limits,
+        spool_dir=args.spool_dir, spool_timeout=args.spool_timeout,
+        fit_pages=args.fit_pages, fit_trim=args.fit_trim, only_tex=args.only_tex,
+        verbose=args.verbose, build_cmds=args.build_cmds
     )
     cv_maker.make()
 
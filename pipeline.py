@@ -0,0 +1,328 @@
+from __future__ import print_function
+import hashlib
+import json
+import os
+import shlex
+import threading
+import time
+
+import six
+from texlog import parse_log_file
+from utility import ExternalCommandWrapper
+
+# files whose changes mean that LaTeX has to be run again
+CHECKSUM_EXTS = ('.aux', '.toc', '.out', '.bbl')
+
+# where latexrun puts the LaTeX log (and other intermediate files) by default, LaTeXCVMaker
+# uses a sub-directory of it per tex file
+LATEXRUN_OBJ_DIR = 'latex.out'
+
+DEFAULT_MAX_RERUNS = 3
+
+# held while an exclusive step runs, so that at most one of them runs at a time in the process
+_exclusive_lock = threading.Lock()
+
+
+class BuildPipelineError(Exception):
+    pass
+
+
+class BuildStep:
+    """A build command together with the condition under which it is executed.
+
+       The condition can be
+           None:    always run the command once
+           'bib':   run the command only if the citations or the bibliography database changed
+           'rerun': run the command (at most `max_runs` times) while LaTeX asks for a rerun
+
+       An `exclusive` command never runs at the same time as another exclusive one (of any pipeline
+       in the process), e.g., texliveonfly, which installs the missing packages with tlmgr.
+    """
+
+    def __init__(self, cmd, condition=None, max_runs=1, exclusive=False):
+        assert isinstance(cmd, list) or isinstance(cmd, tuple)
+        assert condition in (None, 'bib', 'rerun')
+        assert max_runs >= 1
+        self.cmd = list(cmd)
+        self.condition = condition
+        self.max_runs = max_runs
+        self.exclusive = exclusive
+
+    def command(self, tex_file):
+        """Return the command for `tex_file`, with build system variables expanded"""
+        file_base_name = os.path.splitext(os.path.basename(tex_file))[0]
+        # `$file_base_name` has to be expanded before `$file`
+        return [s.replace('$file_base_name', file_base_name).replace('$file', tex_file) for s in self.cmd]
+
+
+def parse_build_step(s):
+    """Parse a custom build command, e.g., `pdflatex $file`, into a `BuildStep`.
+
+       The command can be prefixed with a condition:
+           `@bib bibtex $file_base_name`: run bibtex only if needed
+           `@rerun=4 pdflatex $file`:     rerun pdflatex while needed, but at most 4 times
+                                          (`@rerun` alone allows 3 reruns)
+    """
+    if isinstance(s, six.string_types):
+        try:
+            tokens = shlex.split(s)
+        except ValueError as e:
+            raise BuildPipelineError("Invalid build command `{0}`: ".format(s) + str(e))
+    else:
+        tokens = list(s)
+    if len(tokens) == 0:
+        raise BuildPipelineError("Empty build command")
+    if not tokens[0].startswith('@'):
+        return BuildStep(tokens)
+
+    condition, _, max_runs = tokens[0][1:].partition('=')
+    if len(tokens) == 1 or condition not in ('bib', 'rerun') or (max_runs and condition != 'rerun'):
+        raise BuildPipelineError("Invalid build command `{0}`".format(" ".join(tokens)))
+    if condition == 'bib':
+        return BuildStep(tokens[1:], condition='bib')
+    try:
+        max_runs = int(max_runs) if max_runs else DEFAULT_MAX_RERUNS
+    except ValueError:
+        raise BuildPipelineError("Invalid number of reruns in `{0}`".format(tokens[0]))
+    if max_runs < 1:
+        raise BuildPipelineError("Invalid number of reruns in `{0}`".format(tokens[0]))
+    return BuildStep(tokens[1:], condition='rerun', max_runs=max_runs)
+
+
+def file_digest(filename):
+    """Return the md5 digest of a file, or None if it does not exist"""
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except (OSError, IOError):
+        return None
+
+
+class BuildPipeline:
+    """Run a list of `BuildStep`s on a tex file, skipping the steps whose conditions do not hold."""
+
+    def __init__(self, steps, cwd, state_dir=None, limits=None, verbose=False):
+        self.steps = steps
+        self.cwd = cwd
+        self.state_dir = state_dir
+        # resource limits of each command (see `utility.resource_limits_command`)
+        self.limits = limits
+        self.verbose = verbose
+
+    def run(self, tex_file):
+        """Build `tex_file`, which is a path in `self.cwd`, and return a report (a dict) of the build,
+           which contains the diagnostics parsed from the log of the last LaTeX run and the time spent
+           in each executed command"""
+        build = self.__build(tex_file)
+        try:
+            cmd, step = next(build)
+            while True:
+                wrapper = ExternalCommandWrapper(cmd=cmd[0], cmd_args=cmd[1:], cwd=self.cwd, limits=self.limits,
+                                                 verbose=self.verbose)
+                if step.exclusive:
+                    _exclusive_lock.acquire()
+                try:
+                    start = time.time()
+                    returncode = wrapper.run()
+                finally:
+                    if step.exclusive:
+                        _exclusive_lock.release()
+                cmd, step = build.send((returncode, time.time() - start))
+        except StopIteration as e:
+            return e.value
+
+    async def run_async(self, tex_file, semaphore=None):
+        """Like `run`, but the commands are executed with asyncio subprocesses, each of them after
+           acquiring `semaphore` (if given), and the bookkeeping between them (checksums, log parsing
+           and build state) runs in the default executor. If cancelled, the running command is killed."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        build = self.__build(tex_file)
+        done, value = await loop.run_in_executor(None, self.__advance, build, None)
+        while not done:
+            cmd, step = value
+            wrapper = ExternalCommandWrapper(cmd=cmd[0], cmd_args=cmd[1:], cwd=self.cwd, limits=self.limits,
+                                             verbose=self.verbose)
+            if step.exclusive:
+                await self.__acquire_exclusive(loop)
+            try:
+                if semaphore is None:
+                    start = time.time()
+                    returncode = await wrapper.run_async()
+                else:
+                    async with semaphore:
+                        start = time.time()
+                        returncode = await wrapper.run_async()
+            finally:
+                if step.exclusive:
+                    _exclusive_lock.release()
+            done, value = await loop.run_in_executor(None, self.__advance, build, (returncode, time.time() - start))
+        return value
+
+    @staticmethod
+    async def __acquire_exclusive(loop):
+        """Acquire `_exclusive_lock` without blocking the event loop"""
+        import asyncio
+
+        acquired = loop.run_in_executor(None, _exclusive_lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # the executor still gets the lock, which has to be released then
+            acquired.add_done_callback(lambda _: _exclusive_lock.release())
+            raise
+
+    @staticmethod
+    def __advance(build, result):
+        """Send the result of the last command (None at first) to the build generator, and return
+           (False, the next command and its step) or (True, the report), since `StopIteration` cannot cross futures"""
+        try:
+            return False, (next(build) if result is None else build.send(result))
+        except StopIteration as e:
+            return True, e.value
+
+    def __build(self, tex_file):
+        """The build of `tex_file` as a generator, which yields each command to execute (and its
+           step) and gets back its exit code and time, so that `run` and `run_async` share the logic"""
+        stem = os.path.join(self.cwd, os.path.splitext(os.path.basename(tex_file))[0]).replace('\\', '/')
+        self.__stem = stem
+        name = os.path.basename(stem)
+        self.__log_files = [stem + '.log'] + [os.path.join(self.cwd, LATEXRUN_OBJ_DIR, obj_dir, name + '.log')
+                                              .replace('\\', '/') for obj_dir in ('', name)]
+        self.__state = self.__load_state()
+        # nothing is known before the first step, so the first `@rerun` step must run
+        self.__changed = True
+        self.__log_mtime = self.__log_file_mtime()
+        self.__diagnostics = None
+        self.__passes = []
+
+        for step in self.steps:
+            if step.condition is None:
+                yield from self.__execute(step, tex_file)
+            elif step.condition == 'bib':
+                bib_digest = self.__bib_digest()
+                if (not os.path.exists(stem + '.bbl')) or bib_digest != self.__state.get('bib'):
+                    yield from self.__execute(step, tex_file)
+                    if self.__passes[-1]['returncode'] == 0:
+                        self.__state['bib'] = self.__bib_digest()
+                    else:
+                        # a failed run (e.g., a syntax error in a .bib file) must be retried next time
+                        self.__state.pop('bib', None)
+                elif self.verbose:
+                    print("Skipping `{0}` since the bibliography did not change".format(" ".join(step.cmd)))
+            else:
+                runs = 0
+                while runs < step.max_runs and (self.__changed or self.__rerun_hint()):
+                    yield from self.__execute(step, tex_file)
+                    runs += 1
+                if self.verbose and runs == 0:
+                    print("Skipping `{0}` since no rerun is needed".format(" ".join(step.cmd)))
+
+        self.__save_state()
+
+        report = {
+            'target': tex_file,
+            'passes': self.__passes,
+            'seconds': sum(p['seconds'] for p in self.__passes),
+        }
+        if self.__diagnostics is None:
+            self.__diagnostics = {'errors': [], 'missing_files': [], 'missing_fonts': [], 'boxes': [],
+                                  'rerun': False, 'pages': None}
+        report.update(self.__diagnostics)
+        return report
+
+    def __execute(self, step, tex_file):
+        before = self.__checksums()
+        cmd = step.command(tex_file)
+        returncode, seconds = yield cmd, step
+        record = {'command': " ".join(cmd), 'returncode': returncode, 'seconds': seconds}
+        self.__changed = (self.__checksums() != before)
+        log_mtime = self.__log_file_mtime()
+        if log_mtime != self.__log_mtime:
+            # only a LaTeX run rewrites the log, so the log is parsed (once) only after such a run
+            self.__log_mtime = log_mtime
+            self.__diagnostics = self.__parse_log()
+            if self.__diagnostics is not None:
+                record['pages'] = self.__diagnostics['pages']
+        self.__passes.append(record)
+
+    def __checksums(self):
+        return [file_digest(self.__stem + ext) for ext in CHECKSUM_EXTS]
+
+    def __rerun_hint(self):
+        return self.__diagnostics is not None and self.__diagnostics['rerun']
+
+    def __latest_log_file(self):
+        latest, latest_mtime = None, None
+        for log_file in self.__log_files:
+            mtime = self.__mtime(log_file)
+            if mtime is not None and (latest_mtime is None or mtime > latest_mtime):
+                latest, latest_mtime = log_file, mtime
+        return latest
+
+    def __log_file_mtime(self):
+        log_file = self.__latest_log_file()
+        return None if log_file is None else (log_file, self.__mtime(log_file))
+
+    def __parse_log(self):
+        log_file = self.__latest_log_file()
+        if log_file is None:
+            return None
+        try:
+            return parse_log_file(log_file)
+        except (OSError, IOError):
+            return None
+
+    def __bib_digest(self):
+        """Digest of the citations and the bibliography database(s) referred to by the .aux file"""
+        try:
+            with open(self.__stem + '.aux', 'rb') as f:
+                aux_lines = f.read().decode('utf-8', 'replace').splitlines()
+        except (OSError, IOError):
+            return None
+        md5 = hashlib.md5()
+        for line in aux_lines:
+            if line.startswith(('\\citation{', '\\bibstyle{', '\\bibdata{')):
+                md5.update(line.encode('utf-8'))
+            if line.startswith('\\bibdata{'):
+                for bib in line[len('\\bibdata{'):].rstrip('}').split(','):
+                    bib = bib.strip()
+                    if not bib.endswith('.bib'):
+                        bib += '.bib'
+                    md5.update(str(file_digest(os.path.join(self.cwd, bib))).encode('utf-8'))
+        return md5.hexdigest()
+
+    @staticmethod
+    def __mtime(filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def __state_file(self):
+        if self.state_dir is None:
+            return None
+        return os.path.join(self.state_dir, os.path.basename(self.__stem) + '.json').replace('\\', '/')
+
+    def __load_state(self):
+        state_file = self.__state_file()
+        if state_file is None or not os.path.exists(state_file):
+            return {}
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, IOError, ValueError):
+            return {}
+
+    def __save_state(self):
+        state_file = self.__state_file()
+        if state_file is None:
+            return
+        try:
+            if not os.path.isdir(self.state_dir):
+                os.makedirs(self.state_dir)
+            with open(state_file, 'w') as f:
+                json.dump(self.__state, f)
+        except OSError as e:
+            raise BuildPipelineError("Failed to save build state `{0}`: ".format(state_file) + str(e))
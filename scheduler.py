@@ -0,0 +1,170 @@
+from __future__ import print_function
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+# priority levels, jobs of a lower level run first
+PRIORITIES = {
+    'interactive': 0,  # e.g., a preview a user is waiting for
+    'batch': 1,        # e.g., the nightly regeneration of every CV
+}
+
+DEFAULT_MAX_QUEUE = 64
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class SchedulerFullError(SchedulerError):
+    """The job is rejected since the queue is full"""
+    pass
+
+
+class BuildJob:
+    def __init__(self, maker, priority, limits):
+        self.maker = maker
+        self.priority = priority
+        self.limits = limits
+        self.future = Future()
+        self.submitted = time.time()
+
+
+class BuildScheduler:
+    """Run `LaTeXCVMaker`s on a fixed number of worker threads.
+
+       Jobs wait in a bounded queue, ordered by priority (see `PRIORITIES`) and then by submission.
+       When the queue is full, `submit` either rejects the job or blocks until there is room.
+       The build commands of each job run with `limits` (see `utility.resource_limits_command`)
+       unless the maker sets its own `resource_limits`.
+    """
+
+    def __init__(self, workers=1, max_queue=DEFAULT_MAX_QUEUE, limits=None, verbose=False):
+        assert workers >= 1 and max_queue >= 1
+        self.max_queue = max_queue
+        self.limits = limits
+        self.verbose = verbose
+
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__shutdown = False
+        self.__running = 0
+        self.__counts = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        self.__waits = dict((p, {'count': 0, 'total': 0.0, 'max': 0.0}) for p in PRIORITIES)
+
+        self.__workers = [threading.Thread(target=self.__work, name='latexcv-worker-{0}'.format(i))
+                          for i in range(workers)]
+        for worker in self.__workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, maker, priority='batch', block=False, timeout=None, limits=None):
+        """Queue `maker` (a `LaTeXCVMaker`) and return a `concurrent.futures.Future` of `maker.make()`.
+
+           If the queue is full, raise `SchedulerFullError` unless `block` is true, in which case wait
+           (at most `timeout` seconds if given) for room in the queue.
+        """
+        if priority not in PRIORITIES:
+            raise SchedulerError("Unknown priority `{0}` (expected one of: {1})".format(
+                priority, ", ".join(sorted(PRIORITIES, key=PRIORITIES.get))))
+        job = BuildJob(maker, priority, limits if limits is not None else self.limits)
+        with self.__condition:
+            if self.__shutdown:
+                raise SchedulerError("The scheduler is shut down")
+            if len(self.__queue) >= self.max_queue:
+                has_room = block and self.__condition.wait_for(
+                    lambda: self.__shutdown or len(self.__queue) < self.max_queue, timeout)
+                if self.__shutdown:
+                    raise SchedulerError("The scheduler is shut down")
+                if not has_room:
+                    self.__counts['rejected'] += 1
+                    raise SchedulerFullError("The build queue is full ({0} jobs)".format(len(self.__queue)))
+            heapq.heappush(self.__queue, (PRIORITIES[priority], next(self.__sequence), job))
+            self.__counts['submitted'] += 1
+            self.__condition.notify_all()
+        return job.future
+
+    def metrics(self):
+        """Return the queue depth (in total and per priority), the number of running jobs, the job
+           counters and the time jobs waited in the queue (per priority)"""
+        with self.__condition:
+            depth = dict((p, 0) for p in PRIORITIES)
+            for _, _, job in self.__queue:
+                depth[job.priority] += 1
+            waits = {}
+            for priority, wait in self.__waits.items():
+                waits[priority] = dict(wait)
+                waits[priority]['mean'] = wait['total'] / wait['count'] if wait['count'] else 0.0
+            now = time.time()
+            oldest = max([now - job.submitted for _, _, job in self.__queue] or [0.0])
+            metrics = {
+                'queue_depth': len(self.__queue),
+                'queue_depth_by_priority': depth,
+                'max_queue': self.max_queue,
+                'running': self.__running,
+                'oldest_wait_seconds': oldest,
+                'wait_seconds': waits,
+            }
+            metrics.update(self.__counts)
+            return metrics
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stop accepting jobs. The queued jobs still run unless `cancel_pending` is true."""
+        with self.__condition:
+            self.__shutdown = True
+            if cancel_pending:
+                for _, _, job in self.__queue:
+                    job.future.cancel()
+                    self.__counts['cancelled'] += 1
+                self.__queue = []
+            self.__condition.notify_all()
+        if wait:
+            for worker in self.__workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+
+    def __work(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__shutdown or len(self.__queue) > 0)
+                if len(self.__queue) == 0:
+                    return
+                _, _, job = heapq.heappop(self.__queue)
+                # there is room in the queue again
+                self.__condition.notify_all()
+                if not job.future.set_running_or_notify_cancel():
+                    self.__counts['cancelled'] += 1
+                    continue
+                self.__running += 1
+                self.__record_wait(job)
+
+            if self.verbose:
+                print("Starting {0} job after waiting {1:.1f}s".format(job.priority, time.time() - job.submitted))
+            try:
+                if job.limits is not None and getattr(job.maker, 'resource_limits', None) is None:
+                    job.maker.resource_limits = job.limits
+                result = job.maker.make()
+            except BaseException as e:
+                job.future.set_exception(e)
+                outcome = 'failed'
+            else:
+                job.future.set_result(result)
+                outcome = 'completed'
+            with self.__condition:
+                self.__running -= 1
+                self.__counts[outcome] += 1
+
+    def __record_wait(self, job):
+        wait = self.__waits[job.priority]
+        seconds = time.time() - job.submitted
+        wait['count'] += 1
+        wait['total'] += seconds
+        wait['max'] = max(wait['max'], seconds)
@@ -0,0 +1,66 @@
+import pytest
+
+from autofit import AutoFitError, fit_pages, search_first, search_richest, trim_config, trim_order
+
+
+def make_test(fits, calls=None):
+    def test(probes):
+        if calls is not None:
+            calls.append(list(probes))
+        return [fits(probe) for probe in probes]
+    return test
+
+
+@pytest.mark.parametrize('width', [1, 2, 4])
+@pytest.mark.parametrize('count', [1, 2, 5, 16])
+def test_search_first(count, width):
+    for first in range(count + 1):
+        calls = []
+        found = search_first(count, make_test(lambda i: i >= first, calls), width)
+        assert found == (first if first < count else None)
+        assert all(len(probes) <= width for probes in calls)
+
+
+def test_search_first_rounds():
+    calls = []
+    assert search_first(16, make_test(lambda i: i >= 6, calls), width=4) == 6
+    assert len(calls) <= 2
+
+
+@pytest.mark.parametrize('width', [1, 4])
+def test_search_richest_not_monotone_across_levels(width):
+    # 4 spacings per level: the tightest spacing fits without leaving anything out, although the
+    # loosest spacing does not fit with one item left out
+    pattern = [0, 0, 0, 1,
+               0, 1, 1, 1,
+               1, 1, 1, 1]
+    fits = make_test(lambda c: bool(pattern[c[0] * 4 + c[1]]))
+    assert search_richest(3, 4, fits, width) == (0, 3)
+
+
+@pytest.mark.parametrize('width', [1, 3])
+def test_search_richest(width):
+    def fits(candidate):
+        trimmed, spacing = candidate
+        return trimmed * 4 + spacing >= 9
+    assert search_richest(5, 4, make_test(fits), width) == (2, 1)
+    assert search_richest(2, 4, make_test(fits), width) is None
+
+
+def test_trim_order():
+    config = {'project': [{'name': 'a', 'priority': 1}, {'name': 'b'}, {'name': 'c'}],
+              'publication': {'cite_key': ['x', 'y']}}
+    order = trim_order(config, ('project', 'publication.cite_key'))
+    assert order == [('project', 2), ('publication.cite_key', 1), ('project', 1),
+                     ('publication.cite_key', 0), ('project', 0)]
+    trimmed = trim_config(config, set(order[:2]))
+    assert [p['name'] for p in trimmed['project']] == ['a', 'b']
+    assert trimmed['publication']['cite_key'] == ['x']
+    assert len(config['project']) == 3 and config['publication']['cite_key'] == ['x', 'y']
+
+
+@pytest.mark.parametrize('max_pages', [0, -1])
+def test_fit_pages_rejects_invalid_page_counts(max_pages):
+    # before rendering or compiling anything
+    with pytest.raises(AutoFitError):
+        fit_pages({}, max_pages=max_pages, build_cmds=[['false']])
@@ -0,0 +1,40 @@
+import pytest
+from jinja2 import DictLoader, Environment
+
+from config_check import ConfigCheckError, check_templates, known_keys
+
+TEMPLATES = {
+    'cv.tex': '{{ cv.me.name }}{% if cv.objective %}{% include "objective.tex" %}{% endif %}',
+    'objective.tex': '{{ cv.objective.text }}',
+    'other.tex': '{% for item in cv.education %}{{ item.school }}{% endfor %}',
+    'notes.txt': '{{ cv.notes }}',
+}
+
+
+@pytest.fixture
+def env():
+    return Environment(loader=DictLoader(TEMPLATES))
+
+
+def test_known_keys(env):
+    assert known_keys(env, extensions=('tex',)) == {'me', 'objective', 'education'}
+    assert known_keys(env) == {'me', 'objective', 'education', 'notes'}
+
+
+def test_known_keys_of_whole_root(env):
+    env = Environment(loader=DictLoader({'cv.tex': '{{ cv }}'}))
+    assert known_keys(env) is None
+
+
+def test_keys_of_other_templates_are_known(env):
+    # `education` is only used by another template, e.g. one of another variant
+    check_templates(env, ['cv.tex'], {'me': {'name': 'A'}, 'education': []}, extensions=('tex',))
+
+
+def test_unknown_keys_are_reported(env):
+    with pytest.raises(ConfigCheckError) as e:
+        check_templates(env, ['cv.tex'], {'me': {'name': 'A'}, 'objectve': {}, 'zzz': 1}, extensions=('tex',))
+    assert str(e.value).split('\n') == [
+        "`objectve` is an unknown key (did you mean `objective`?)",
+        "`zzz` is an unknown key",
+    ]
@@ -0,0 +1,20 @@
+import os
+
+import latexcv
+from latexcv import LaTeXCVMaker
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_makers_share_the_environment(tmp_path):
+    temp_dir = os.path.join(PACKAGE_DIR, 'templates', 'default')
+    env = latexcv.get_environment(temp_dir)
+    count = len(latexcv._environments)
+    # e.g., a server making the CV of each request in a build directory of its own
+    for i in range(3):
+        maker = LaTeXCVMaker(temp_dir=temp_dir, cv_config=os.path.join(PACKAGE_DIR, '_config.yaml'),
+                             build_dir=str(tmp_path / 'build{0}'.format(i)), only_tex=True, cleanup='unlink')
+        maker.make()
+        assert os.path.exists(str(tmp_path / 'build{0}'.format(i) / 'cv_single.tex'))
+    assert len(latexcv._environments) == count
+    assert latexcv.get_environment(temp_dir, bytecode_dir=str(tmp_path / 'bytecode')) is env
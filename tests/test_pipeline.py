@@ -0,0 +1,136 @@
+import os
+import sys
+
+import pytest
+
+from pipeline import BuildPipeline, parse_build_step
+
+# a LaTeX which writes the citations and the bibliography database of the tex file to the .aux file,
+# and asks for a rerun in the log as long as `reruns` says so
+FAKE_LATEX = '''
+import os, re, sys
+stem = os.path.splitext(sys.argv[1])[0]
+with open('runs', 'a') as f:
+    f.write('latex\\n')
+with open(stem + '.tex') as f:
+    tex = f.read()
+reruns = int(open('reruns').read()) if os.path.exists('reruns') else 0
+with open(stem + '.aux', 'w') as f:
+    for key in re.findall(r'\\\\cite\\{([^}]*)\\}', tex):
+        f.write('\\\\citation{%s}\\n' % key)
+    for bib in re.findall(r'\\\\bibliography\\{([^}]*)\\}', tex):
+        f.write('\\\\bibdata{%s}\\n' % bib)
+with open('reruns', 'w') as f:
+    f.write(str(max(0, reruns - 1)))
+with open(stem + '.log', 'w') as f:
+    if reruns > 0:
+        f.write('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\\n')
+    f.write('Output written on %s.pdf (1 page, 100 bytes).\\n' % stem)
+'''
+
+# a bibtex which writes the cited entries to the .bbl file, and then fails (as bibtex still writes the
+# .bbl file) if the database contains `ERROR`
+FAKE_BIBTEX = '''
+import sys
+stem = sys.argv[1]
+with open('runs', 'a') as f:
+    f.write('bibtex\\n')
+with open('refs.bib') as f:
+    bib = f.read()
+with open(stem + '.aux') as f:
+    citations = [line for line in f if line.startswith('\\\\citation')]
+with open(stem + '.bbl', 'w') as f:
+    f.write(''.join(citations) + bib)
+sys.exit(1 if 'ERROR' in bib else 0)
+'''
+
+
+class Project:
+    def __init__(self, path):
+        self.path = path
+        self.latex = str(path / 'latex.py')
+        self.bibtex = str(path / 'bibtex.py')
+        (path / 'latex.py').write_text(FAKE_LATEX)
+        (path / 'bibtex.py').write_text(FAKE_BIBTEX)
+        self.write('cv.tex', '\\cite{a}\n\\bibliography{refs}\n')
+        self.write('refs.bib', '@misc{a}\n')
+
+    def write(self, name, content):
+        (self.path / name).write_text(content)
+
+    def build(self, *steps):
+        """Build `cv.tex` with `steps` (`latex`, `@bib` and `@rerun[=N]`) and return the commands run"""
+        build_steps = []
+        for step in steps:
+            condition = [step] if step.startswith('@') else []
+            if step == '@bib':
+                build_steps.append(parse_build_step(condition + [sys.executable, self.bibtex, '$file_base_name']))
+            else:
+                build_steps.append(parse_build_step(condition + [sys.executable, self.latex, '$file']))
+        runs = self.path / 'runs'
+        if runs.exists():
+            runs.unlink()
+        report = BuildPipeline(build_steps, str(self.path), state_dir=str(self.path / 'state')).run('cv.tex')
+        assert report['pages'] == 1
+        return runs.read_text().split() if runs.exists() else []
+
+
+@pytest.fixture
+def project(tmp_path):
+    return Project(tmp_path)
+
+
+STEPS = ('latex', '@bib', '@rerun=3')
+
+
+def test_bib_step_is_skipped_if_nothing_changed(project):
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+    assert project.build(*STEPS) == ['latex']
+
+
+def test_bib_step_runs_if_the_database_changed(project):
+    project.build(*STEPS)
+    project.write('refs.bib', '@misc{a, title={A}}\n')
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+
+
+def test_bib_step_runs_if_the_citations_changed(project):
+    project.build(*STEPS)
+    project.write('cv.tex', '\\cite{a}\\cite{b}\n\\bibliography{refs}\n')
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+
+
+def test_bib_step_runs_if_the_bbl_is_missing(project):
+    project.build(*STEPS)
+    os.remove(str(project.path / 'cv.bbl'))
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+
+
+def test_failed_bib_step_is_retried(project):
+    project.write('refs.bib', '@misc{a ERROR\n')
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+    # nothing changed, but the last run failed
+    assert project.build(*STEPS) == ['latex', 'bibtex']
+    project.write('refs.bib', '@misc{a}\n')
+    assert project.build(*STEPS) == ['latex', 'bibtex', 'latex']
+    assert project.build(*STEPS) == ['latex']
+
+
+def test_rerun_step_follows_the_rerun_hints(project):
+    project.build(*STEPS)
+    project.write('reruns', '2')
+    # the first pass and the first rerun ask for a rerun
+    assert project.build(*STEPS) == ['latex', 'latex', 'latex']
+
+
+def test_rerun_step_is_capped_at_max_runs(project):
+    project.write('reruns', '10')
+    assert project.build('latex', '@rerun=2') == ['latex', 'latex', 'latex']
+    assert project.build('latex', '@rerun') == ['latex', 'latex', 'latex', 'latex']
+
+
+def test_first_rerun_step_always_runs(project):
+    # the .aux file is new after the first pass
+    assert project.build('@rerun') == ['latex', 'latex']
+    # even if nothing changed since the last build
+    assert project.build('@rerun') == ['latex']
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import BuildScheduler, SchedulerError, SchedulerFullError
+
+
+class StubMaker:
+    """Records the order of the makes, which wait for `release` if given"""
+
+    def __init__(self, name, log, release=None, error=None, resource_limits=None):
+        self.name = name
+        self.log = log
+        self.release = release
+        self.error = error
+        self.resource_limits = resource_limits
+        self.started = threading.Event()
+
+    def make(self):
+        self.started.set()
+        if self.release is not None:
+            assert self.release.wait(10)
+        self.log.append(self.name)
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+@pytest.fixture
+def busy_scheduler():
+    """A scheduler with a single worker, busy with a job until `release` is set"""
+    release = threading.Event()
+    log = []
+    scheduler = BuildScheduler(workers=1, max_queue=2)
+    blocker = StubMaker('blocker', log, release)
+    future = scheduler.submit(blocker)
+    assert blocker.started.wait(10)
+    yield scheduler, release, log, future
+    release.set()
+    scheduler.shutdown(wait=True, cancel_pending=True)
+
+
+def test_priority_ordering(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    scheduler.max_queue = 8
+    futures = [scheduler.submit(StubMaker(name, log), priority)
+               for name, priority in (('batch-1', 'batch'), ('interactive-1', 'interactive'),
+                                      ('batch-2', 'batch'), ('interactive-2', 'interactive'))]
+    release.set()
+    assert [f.result(10) for f in futures] == ['batch-1', 'interactive-1', 'batch-2', 'interactive-2']
+    assert log == ['blocker', 'interactive-1', 'interactive-2', 'batch-1', 'batch-2']
+
+
+def test_unknown_priority(busy_scheduler):
+    scheduler, _, log, _ = busy_scheduler
+    with pytest.raises(SchedulerError):
+        scheduler.submit(StubMaker('job', log), priority='urgent')
+
+
+def test_full_queue_rejects(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    scheduler.submit(StubMaker('job-1', log))
+    scheduler.submit(StubMaker('job-2', log))
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit(StubMaker('job-3', log))
+    assert scheduler.metrics()['rejected'] == 1
+
+
+def test_full_queue_blocks_until_timeout(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    scheduler.submit(StubMaker('job-1', log))
+    scheduler.submit(StubMaker('job-2', log))
+    start = time.time()
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit(StubMaker('job-3', log), block=True, timeout=0.3)
+    assert time.time() - start >= 0.3
+    assert scheduler.metrics()['rejected'] == 1
+
+
+def test_full_queue_blocks_until_there_is_room(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    scheduler.submit(StubMaker('job-1', log))
+    scheduler.submit(StubMaker('job-2', log))
+    threading.Timer(0.2, release.set).start()
+    future = scheduler.submit(StubMaker('job-3', log), block=True, timeout=10)
+    assert future.result(10) == 'job-3'
+    assert log == ['blocker', 'job-1', 'job-2', 'job-3']
+
+
+def test_shutdown_cancels_pending_jobs(busy_scheduler):
+    scheduler, release, log, blocker = busy_scheduler
+    pending = [scheduler.submit(StubMaker('job-{0}'.format(i), log)) for i in range(2)]
+    scheduler.shutdown(wait=False, cancel_pending=True)
+    with pytest.raises(SchedulerError):
+        scheduler.submit(StubMaker('late', log))
+    release.set()
+    assert blocker.result(10) == 'blocker'
+    assert all(f.cancelled() for f in pending)
+    scheduler.shutdown(wait=True)
+    assert log == ['blocker']
+    metrics = scheduler.metrics()
+    assert (metrics['completed'], metrics['cancelled'], metrics['queue_depth']) == (1, 2, 0)
+
+
+def test_shutdown_runs_pending_jobs(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    pending = [scheduler.submit(StubMaker('job-{0}'.format(i), log)) for i in range(2)]
+    release.set()
+    scheduler.shutdown(wait=True)
+    assert [f.result(0) for f in pending] == ['job-0', 'job-1']
+
+
+def test_metrics(busy_scheduler):
+    scheduler, release, log, _ = busy_scheduler
+    ok = scheduler.submit(StubMaker('ok', log), 'interactive')
+    failing = scheduler.submit(StubMaker('failing', log, error=RuntimeError('boom')))
+    metrics = scheduler.metrics()
+    assert metrics['queue_depth'] == 2
+    assert metrics['queue_depth_by_priority'] == {'interactive': 1, 'batch': 1}
+    assert metrics['running'] == 1
+    assert metrics['submitted'] == 3
+    assert metrics['oldest_wait_seconds'] >= 0
+
+    release.set()
+    assert ok.result(10) == 'ok'
+    with pytest.raises(RuntimeError):
+        failing.result(10)
+    scheduler.shutdown(wait=True)
+    metrics = scheduler.metrics()
+    assert (metrics['completed'], metrics['failed'], metrics['running'], metrics['queue_depth']) == (2, 1, 0, 0)
+    assert metrics['wait_seconds']['interactive']['count'] == 1
+    assert metrics['wait_seconds']['batch']['count'] == 2
+    assert metrics['wait_seconds']['batch']['max'] >= metrics['wait_seconds']['batch']['mean'] >= 0
+
+
+def test_limits():
+    log = []
+    with BuildScheduler(workers=2, limits={'cpu_time': 60}) as scheduler:
+        default = StubMaker('default', log)
+        own = StubMaker('own', log, resource_limits={'cpu_time': 5})
+        per_job = StubMaker('per-job', log)
+        for f in (scheduler.submit(default), scheduler.submit(own),
+                  scheduler.submit(per_job, limits={'memory': 1 << 30})):
+            f.result(10)
+    assert default.resource_limits == {'cpu_time': 60}
+    assert own.resource_limits == {'cpu_time': 5}
+    assert per_job.resource_limits == {'memory': 1 << 30}
@@ -0,0 +1,123 @@
+import pytest
+
+from texlog import MAX_PRINT_LINE, LaTeXLogParser, parse_log_file
+
+
+def parse(log, chunk_size=None):
+    parser = LaTeXLogParser()
+    if chunk_size is None:
+        parser.feed(log)
+    else:
+        for i in range(0, len(log), chunk_size):
+            parser.feed(log[i:i + chunk_size])
+    parser.close()
+    return parser.result()
+
+
+def wrap(line):
+    """Wrap `line` as TeX does in its log"""
+    lines = [line[i:i + MAX_PRINT_LINE] for i in range(0, len(line), MAX_PRINT_LINE)]
+    if len(line) % MAX_PRINT_LINE == 0:
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 7, 80])
+def test_wrapped_lines_are_joined(chunk_size):
+    path = './' + 'very/long/path/' * 10 + 'file.tex'
+    log = wrap('(' + path) + wrap("! LaTeX Error: File `" + 'x' * 100 + ".sty' not found.") + \
+        'l.3 \\usepackage\n)\n'
+    result = parse(log, chunk_size)
+    assert result['errors'] == [{'message': "LaTeX Error: File `" + 'x' * 100 + ".sty' not found.",
+                                 'file': path, 'line': 3}]
+    assert result['missing_files'] == ['x' * 100 + '.sty']
+
+
+def test_line_of_exactly_max_print_line_characters():
+    result = parse(wrap('A' * MAX_PRINT_LINE) + '! Undefined control sequence.\nl.12 \\foo\n')
+    assert result['errors'] == [{'message': 'Undefined control sequence.', 'file': None, 'line': 12}]
+
+    result = parse(wrap('A' * MAX_PRINT_LINE) + 'Output written on cv_single.pdf (2 pages, 1234 bytes).\n')
+    assert result['pages'] == 2
+
+
+def test_error_is_never_joined_to_a_full_line():
+    # a full line followed by an error, without the empty line
+    result = parse('A' * MAX_PRINT_LINE + '\n! Missing $ inserted.\nl.7 x^\n')
+    assert [(e['message'], e['line']) for e in result['errors']] == [('Missing $ inserted.', 7)]
+
+
+def test_errors_in_files():
+    log = ('(./cv_single.tex (/usr/share/texlive/texmf-dist/tex/latex/base/article.cls\n'
+           ')\n'
+           '! Undefined control sequence.\n'
+           '<recently read> \\foo\n'
+           'l.42 \\foo\n'
+           ')\n')
+    assert parse(log)['errors'] == [{'message': 'Undefined control sequence.', 'file': './cv_single.tex',
+                                     'line': 42}]
+
+
+def test_file_line_errors():
+    result = parse("./sections/education.tex:5: LaTeX Error: File `foo.sty' not found.\n")
+    assert result['errors'] == [{'message': "LaTeX Error: File `foo.sty' not found.",
+                                 'file': './sections/education.tex', 'line': 5}]
+    assert result['missing_files'] == ['foo.sty']
+
+
+def test_missing_files_and_fonts():
+    log = ("! I can't find file `missing.tex'.\n"
+           "! LaTeX Error: File `foo.sty' not found.\n"
+           "! LaTeX Error: File `foo.sty' not found.\n"
+           "! Font \\TU/lmr/m/n/10=ec-lmr10 at 10.0pt not loadable: Metric (TFM) file not found.\n"
+           '! Font \\x="Nonexistent:mapping=tex-text;" at 10pt not loadable: Metric (TFM) file or installed '
+           'font not found.\n'
+           '! Font \\y=file:fontawesome.otf: at 10pt not loadable\n')
+    result = parse(log)
+    assert result['missing_files'] == ['missing.tex', 'foo.sty']
+    assert result['missing_fonts'] == ['ec-lmr10', '"Nonexistent:mapping=tex-text;"', 'fontawesome.otf']
+    assert len(result['errors']) == 6
+
+
+def test_boxes():
+    log = ('(./cv_single.tex\n'
+           'Overfull \\hbox (12.3pt too wide) in paragraph at lines 10--12\n'
+           'Underfull \\vbox (badness 10000) has occurred while \\output is active\n'
+           'Underfull \\hbox (badness 1234) in alignment at line 7\n'
+           ')\n')
+    assert parse(log)['boxes'] == [
+        {'type': 'overfull', 'box': 'hbox', 'amount': '12.3pt too wide', 'file': './cv_single.tex',
+         'lines': [10, 12]},
+        {'type': 'underfull', 'box': 'vbox', 'amount': 'badness 10000', 'file': './cv_single.tex', 'lines': None},
+        {'type': 'underfull', 'box': 'hbox', 'amount': 'badness 1234', 'file': './cv_single.tex', 'lines': [7, 7]},
+    ]
+
+
+@pytest.mark.parametrize('line, rerun', [
+    ('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.', True),
+    ('Package rerunfilecheck Warning: File `cv.out\' has changed.  Rerun LaTeX.', True),
+    ('Package biblatex Warning: Please rerun LaTeX.', True),
+    ('LaTeX Font Info:    Trying to load font information for OT1+cmr.', False),
+])
+def test_rerun(line, rerun):
+    assert parse(line + '\n')['rerun'] is rerun
+
+
+@pytest.mark.parametrize('line, pages', [
+    ('Output written on cv_single.pdf (1 page, 43210 bytes).', 1),
+    ('Output written on cv_multi.pdf (3 pages, 98765 bytes).', 3),
+    ('No pages of output.', 0),
+    ('Transcript written on cv.log.', None),
+])
+def test_pages(line, pages):
+    assert parse(line + '\n')['pages'] == pages
+
+
+def test_parse_log_file(tmp_path):
+    log_file = tmp_path / 'cv.log'
+    # not valid utf-8, and without a trailing newline
+    log_file.write_bytes(b'(./cv.tex \xe9\n! Undefined control sequence.\nl.2 \\foo\n)\n'
+                         b'Output written on cv.pdf (2 pages, 100 bytes).')
+    result = parse_log_file(str(log_file), chunk_size=5)
+    assert result['errors'] == [{'message': 'Undefined control sequence.', 'file': './cv.tex', 'line': 2}]
+    assert result['pages'] == 2
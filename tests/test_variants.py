@@ -0,0 +1,49 @@
+import os
+import re
+
+import pytest
+
+from latexcv import load_config, render_tex
+from variants import make_variant
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tex_lines(tex_source):
+    """The lines of `tex_source` without the comments (starting with `%%`) and the empty lines"""
+    lines = [re.sub(r'%%.*$', '', line).strip() for line in tex_source.split('\n')]
+    return [line for line in lines if line]
+
+
+@pytest.fixture(scope='module')
+def config():
+    return load_config(os.path.join(PACKAGE_DIR, '_config.yaml'))
+
+
+@pytest.mark.parametrize('layout, template, fit', [
+    ('multi', 'cv_multi.tex', None),
+    ('single', 'cv_single.tex', None),
+    ('single', 'cv_single.tex', {'negspace': -30, 'top_space': -18}),
+])
+def test_default_variants_render_as_the_templates(config, layout, template, fit):
+    variant = render_tex(config, {'name': 'cv', 'layout': layout}, fit=fit)
+    assert tex_lines(variant) == tex_lines(render_tex(config, template, fit=fit))
+
+
+def test_no_spacing_after_the_last_section(config):
+    # `service` is empty, so `skill` is the last section and the spacing after it is left out
+    variant = {'name': 'cv', 'sections': ['education', 'skill', 'service']}
+    tex = tex_lines(render_tex(dict(config, service=[]), variant))
+    end = tex.index('\\end{resume}')
+    assert tex[end - 1] not in ('\\negspace', '\\vspace*{4pt}')
+    assert '\\vspace*{4pt}' not in tex
+
+
+def test_sections_have_their_own_spacing():
+    variant, _ = make_variant({'name': 'cv', 'sections': ['education', 'project_selected', 'honor']}, {})
+    assert [(s['key'], s['space_before'], s['space_after']) for s in variant['sections']] == [
+        ('education', '\\negspace', '\\negspace'),
+        ('project', '', '\\negspace'),
+        ('honor', '', '\\vspace*{2pt}\n\\negspace'),
+    ]
+    assert variant['closing'] == ''
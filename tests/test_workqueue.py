@@ -0,0 +1,147 @@
+import errno
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from latexcv import LaTeXCVMaker
+from workqueue import SpoolQueue
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER = os.path.join(PACKAGE_DIR, 'workqueue.py')
+
+# a build command which records its runs and, after a while, makes a PDF unless told to fail
+BUILD_SCRIPT = '''
+import os, sys, time
+tex_file, runs, seconds, fail = sys.argv[1], sys.argv[2], float(sys.argv[3]), sys.argv[4] == 'fail'
+with open(runs, 'a') as f:
+    f.write('start\\n')
+time.sleep(seconds)
+if not fail:
+    with open(os.path.splitext(tex_file)[0] + '.pdf', 'w') as f:
+        f.write('pdf')
+with open(runs, 'a') as f:
+    f.write('end\\n')
+'''
+
+
+def start_worker(spool_dir):
+    # a session of its own, so that the worker can be killed together with its build command
+    return subprocess.Popen([sys.executable, WORKER, spool_dir, '--poll', '0.1', '--max-idle', '3'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def read_lines(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return f.read().split()
+
+
+@pytest.fixture
+def job_files(tmp_path):
+    tex_file = tmp_path / 'cv.tex'
+    tex_file.write_text('tex')
+    script = tmp_path / 'build.py'
+    script.write_text(BUILD_SCRIPT)
+    return str(tex_file), str(script)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='kills process groups')
+def test_dead_worker_job_is_recovered_and_completed_once(tmp_path, job_files):
+    tex_file, script = job_files
+    spool_dir = str(tmp_path / 'spool')
+    runs = str(tmp_path / 'runs')
+    queue = SpoolQueue(spool_dir, lease_seconds=1)
+    job_id = queue.submit({'tex_file': 'cv.tex', 'build_cmds': [[sys.executable, script, '$file', runs, '1.5', 'ok']]},
+                          [tex_file])
+
+    doomed = start_worker(spool_dir)
+    try:
+        assert wait_for(lambda: read_lines(runs) == ['start'])
+        assert queue.status(job_id) == 'running'
+    finally:
+        os.killpg(doomed.pid, signal.SIGKILL)
+        doomed.wait()
+
+    workers = [start_worker(spool_dir) for _ in range(2)]
+    try:
+        assert wait_for(lambda: queue.status(job_id) == 'done')
+    finally:
+        for worker in workers:
+            worker.wait(timeout=30)
+
+    # killed once, then completed by exactly one of the other workers
+    assert read_lines(runs) == ['start', 'start', 'end']
+    assert sorted(os.path.basename(f) for f in queue.outputs(job_id)) == ['cv.pdf', 'cv.report.json']
+    with open(os.path.join(spool_dir, 'done', job_id, 'job.json')) as f:
+        assert json.load(f)['attempts'] == 2
+    for state in ('pending', 'running', 'failed'):
+        assert os.listdir(os.path.join(spool_dir, state)) == []
+
+
+def test_failing_job_is_retried_then_failed(tmp_path, job_files):
+    tex_file, script = job_files
+    spool_dir = str(tmp_path / 'spool')
+    runs = str(tmp_path / 'runs')
+    queue = SpoolQueue(spool_dir, max_attempts=2)
+    job_id = queue.submit({'tex_file': 'cv.tex', 'build_cmds': [[sys.executable, script, '$file', runs, '0', 'fail']]},
+                          [tex_file])
+
+    workers = [start_worker(spool_dir) for _ in range(2)]
+    try:
+        assert wait_for(lambda: queue.status(job_id) == 'failed')
+    finally:
+        for worker in workers:
+            worker.wait(timeout=30)
+
+    assert read_lines(runs) == ['start', 'end'] * 2
+    assert 'No PDF was produced' in queue.error(job_id)
+
+
+def test_outputs_are_published_across_file_systems(tmp_path, job_files, monkeypatch):
+    _, script = job_files
+    spool_dir = str(tmp_path / 'spool')
+    build_dir = str(tmp_path / 'build')
+    runs = str(tmp_path / 'runs')
+    # the spool is on another file system (e.g., NFS) than the build directory, so renames between them fail
+    def cross_device(rename):
+        def cross_device_rename(src, dst):
+            if os.path.abspath(src).startswith(spool_dir) != os.path.abspath(dst).startswith(spool_dir):
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src, dst)
+            rename(src, dst)
+        return cross_device_rename
+
+    monkeypatch.setattr(os, 'rename', cross_device(os.rename))
+    monkeypatch.setattr(os, 'replace', cross_device(os.replace))
+    SpoolQueue(spool_dir)
+    maker = LaTeXCVMaker(temp_dir=os.path.join(PACKAGE_DIR, 'templates', 'default'),
+                         cv_config=os.path.join(PACKAGE_DIR, '_config.yaml'), build_dir=build_dir,
+                         cleanup='unlink', spool_dir=spool_dir, spool_timeout=30,
+                         build_cmds=[[sys.executable, script, '$file', runs, '0', 'ok']])
+    workers = [start_worker(spool_dir)]
+    try:
+        maker.make()
+    finally:
+        for worker in workers:
+            worker.wait(timeout=30)
+
+    assert read_lines(runs) == ['start', 'end'] * 2
+    for name in ('cv_multi', 'cv_single'):
+        with open(os.path.join(build_dir, name + '.pdf')) as f:
+            assert f.read() == 'pdf'
+    assert sorted(maker.reports) == ['cv_multi.tex', 'cv_single.tex']
+    assert os.listdir(os.path.join(spool_dir, 'done')) == []
@@ -0,0 +1,177 @@
+from __future__ import print_function
+import codecs
+import re
+
+# TeX wraps the lines in its log at `max_print_line` (79 by default) characters
+MAX_PRINT_LINE = 79
+
+RERUN_PATTERN = re.compile(r'(Rerun to get|Rerun LaTeX|Please rerun|Label\(s\) may have changed)')
+
+# `(` either opens a file, e.g. `(./cv_single.tex` or `(/usr/share/texlive/.../article.cls`, or is plain text
+PAREN_PATTERN = re.compile(r'\((?P<file>"?(?:\.{0,2}/|[A-Za-z]:[\\/])[^\s()"]*|[^\s()/"]+\.'
+                           r'(?:tex|sty|cls|clo|cfg|def|fd|ltx|aux|bbl|toc|out|ldf))?|\)')
+FILE_LINE_ERROR_PATTERN = re.compile(r'^(?P<file>[^\s:]+\.\w+):(?P<line>\d+): (?P<message>.*)$')
+ERROR_LINE_PATTERN = re.compile(r'^l\.(?P<line>\d+)')
+MISSING_FILE_PATTERNS = (re.compile(r"! LaTeX Error: File `([^`']*)' not found"),
+                         re.compile(r"! I can't find file `([^`']*)'"))
+# the first matching pattern gives the font, e.g. `fontawesome.otf` for `! Font \x=file:fontawesome.otf: ...`
+MISSING_FONT_PATTERNS = (re.compile(r"! Font [^\n]*file:([^:\n]*):"),
+                         re.compile(r"! Font \\[^=]*=([^\s]*)\s.*not loadable"))
+BOX_PATTERN = re.compile(r'^(?P<kind>Overfull|Underfull) \\(?P<box>[hv]box) \((?P<amount>[^)]*)\)'
+                         r'(?:.*at lines? (?P<first>\d+)(?:--(?P<last>\d+))?)?')
+PAGES_PATTERN = re.compile(r'^Output written on .* \((?P<pages>\d+) pages?')
+
+# how many lines after `! ...` to look for the `l.<number>` line of an error
+ERROR_CONTEXT_LINES = 10
+
+
+class LaTeXLogParser:
+    """An incremental parser for TeX logs.
+
+       Feed the log chunk by chunk with `feed()`, call `close()` when done and get the
+       diagnostics as a dict from `result()`.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.missing_files = []
+        self.missing_fonts = []
+        self.boxes = []
+        self.rerun = False
+        self.pages = None
+
+        self.__tail = ''
+        self.__pending = None
+        self.__files = []
+        self.__error = None
+        self.__error_countdown = 0
+
+    def feed(self, data):
+        """Parse the next chunk (a str) of the log"""
+        lines = (self.__tail + data).split('\n')
+        self.__tail = lines.pop()
+        for line in lines:
+            self.__feed_line(line.rstrip('\r'))
+
+    def close(self):
+        if self.__tail:
+            self.__feed_line(self.__tail)
+            self.__tail = ''
+        if self.__pending is not None:
+            self.__parse_line(self.__pending)
+            self.__pending = None
+
+    def result(self):
+        return {
+            'errors': self.errors,
+            'missing_files': self.missing_files,
+            'missing_fonts': self.missing_fonts,
+            'boxes': self.boxes,
+            'rerun': self.rerun,
+            'pages': self.pages,
+        }
+
+    def __feed_line(self, line):
+        """Join the lines wrapped by TeX before parsing them"""
+        if self.__pending is not None:
+            pending, self.__pending = self.__pending, None
+            # TeX writes an empty line after a line of exactly `MAX_PRINT_LINE` characters, and an
+            # error message always starts a line of its own
+            if len(line) == 0 or line.startswith('!'):
+                self.__parse_line(pending)
+            else:
+                line = pending + line
+        if len(line) > 0 and len(line) % MAX_PRINT_LINE == 0:
+            self.__pending = line
+        else:
+            self.__parse_line(line)
+
+    def __current_file(self):
+        for f in reversed(self.__files):
+            if f is not None:
+                return f
+        return None
+
+    def __parse_line(self, line):
+        if self.__error is not None:
+            m = ERROR_LINE_PATTERN.match(line)
+            if m:
+                self.__error['line'] = int(m.group('line'))
+                self.__error = None
+            else:
+                self.__error_countdown -= 1
+                if self.__error_countdown <= 0:
+                    self.__error = None
+
+        if line.startswith('!'):
+            self.__add_error(line[1:].strip(), self.__current_file(), None)
+            self.__error_countdown = ERROR_CONTEXT_LINES
+            self.__match_missing(line)
+            return
+        m = FILE_LINE_ERROR_PATTERN.match(line)
+        if m:
+            self.__add_error(m.group('message'), m.group('file'), int(m.group('line')))
+            self.__error = None
+            self.__match_missing('! ' + m.group('message'))
+            return
+
+        m = BOX_PATTERN.match(line)
+        if m:
+            lines = None
+            if m.group('first') is not None:
+                lines = [int(m.group('first')), int(m.group('last') or m.group('first'))]
+            self.boxes.append({'type': m.group('kind').lower(), 'box': m.group('box'),
+                               'amount': m.group('amount'), 'file': self.__current_file(), 'lines': lines})
+            return
+
+        if line.startswith('Output written on '):
+            m = PAGES_PATTERN.match(line)
+            if m:
+                self.pages = int(m.group('pages'))
+            return
+        if line.startswith('No pages of output'):
+            self.pages = 0
+            return
+
+        if (not self.rerun) and RERUN_PATTERN.search(line):
+            self.rerun = True
+
+        for m in PAREN_PATTERN.finditer(line):
+            if m.group(0) == ')':
+                if self.__files:
+                    self.__files.pop()
+            else:
+                f = m.group('file')
+                self.__files.append(f.strip('"') if f else None)
+
+    def __add_error(self, message, file, line):
+        self.__error = {'message': message, 'file': file, 'line': line}
+        self.errors.append(self.__error)
+
+    def __match_missing(self, line):
+        for pattern in MISSING_FILE_PATTERNS:
+            m = pattern.search(line)
+            if m and m.group(1) not in self.missing_files:
+                self.missing_files.append(m.group(1))
+        for pattern in MISSING_FONT_PATTERNS:
+            m = pattern.search(line)
+            if m:
+                if m.group(1) not in self.missing_fonts:
+                    self.missing_fonts.append(m.group(1))
+                break
+
+
+def parse_log_file(filename, chunk_size=1 << 16):
+    """Parse the TeX log `filename` in a single pass and return the diagnostics as a dict"""
+    parser = LaTeXLogParser()
+    # TeX logs are not necessarily valid utf-8 (e.g. with 8-bit fonts)
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.result()
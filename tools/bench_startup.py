@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Measure the startup time of `latexcv.py`.
+
+   Usage: python3 tools/bench_startup.py [-n RUNS]
+
+   For each case, the command is run RUNS times and the minimum and median wall-clock times
+   are reported, together with the time of a bare interpreter for reference.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(cmd, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(cmd, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Measure the startup time of latexcv.py')
+    arg_parser.add_argument('-n', metavar='RUNS', type=int, dest='runs', default=20,
+                            help='Number of runs per case (default: 20)')
+    args = arg_parser.parse_args()
+
+    build_dir = tempfile.mkdtemp(prefix='latexcv-bench-')
+    latexcv = os.path.join(ROOT_DIR, 'latexcv.py')
+    cases = [
+        ('python (baseline)', [sys.executable, '-c', 'pass']),
+        ('latexcv.py --help', [sys.executable, latexcv, '--help']),
+        ('latexcv.py --only-tex', [sys.executable, latexcv, '--only-tex', '--build-dir', build_dir,
+                                   '--temp-file', 'cv_single.tex']),
+    ]
+    try:
+        print("{0:<24} {1:>10} {2:>10}".format('startup time', 'min (ms)', 'median (ms)'))
+        for name, cmd in cases:
+            best, median = time_command(cmd, args.runs)
+            print("{0:<24} {1:>10.1f} {2:>10.1f}".format(name, best * 1000, median * 1000))
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,7 +34,12 @@ defaultSpeechSetting = "never"
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/copyleft/gpl.html>.
 
-import re, subprocess, os, time,  optparse, sys, shlex
+import re, subprocess, os, time,  optparse, sys, shlex, threading, io
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:     #python2 without the futures backport; lookups run one at a time
+    ThreadPoolExecutor = None
 
 scriptName = os.path.basename(__file__)     #the name of this script file
 py3 = sys.version_info[0]  >= 3
@@ -55,6 +60,48 @@ subprocess.Popen.communicateStr = communicateStr
 installation_initialized = False
 installing = False
 
+#default number of concurrent package lookups
+defaultLookupJobs = 4
+
+#maps a list of inputs with at most `jobs` of them running at the same time
+def boundedMap(func, inputs, jobs):
+    if ThreadPoolExecutor is None or jobs <= 1 or len(inputs) <= 1:
+        return [ func(x) for x in inputs ]
+    with ThreadPoolExecutor( max_workers = min(jobs, len(inputs)) ) as executor:
+        return list( executor.map(func, inputs) )
+
+#reads the files of every package from a TeX Live package database (texlive.tlpdb),
+#given the database itself or a local mirror containing tlpkg/texlive.tlpdb
+#returns a list of (file path, package name)
+def loadTLPDB(location):
+    if os.path.isdir(location):
+        location = os.path.join(location, "tlpkg", "texlive.tlpdb")
+
+    files = []
+    name = None
+    with io.open(location, encoding = "UTF-8", errors = "replace") as tlpdb:
+        for line in tlpdb:
+            if line.startswith("name "):
+                name = line[len("name "):].strip()
+            elif line.startswith(" ") and name != None and line.strip() != "":
+                #file lines of the runfiles/docfiles/srcfiles sections, e.g. ' texmf-dist/tex/latex/foo/foo.sty'
+                path = line.split()[0]
+                if path.startswith("RELOC/"):
+                    path = "texmf-dist/" + path[len("RELOC/"):]
+                files.append( (path, name) )
+            elif line.strip() == "":
+                name = None
+    return files
+
+#the repository of a local mirror (for tlmgr's --repository), if the location is one
+def localRepository(location):
+    if os.path.isdir(location):
+        return os.path.abspath(location)
+    tlpkg = os.path.dirname( os.path.abspath(location) )
+    if os.path.basename(location) == "texlive.tlpdb" and os.path.basename(tlpkg) == "tlpkg":
+        return os.path.dirname(tlpkg)
+    return None
+
 def generateSudoer(this_terminal_only = False,  tempDirectory = os.path.join(os.getenv("HOME"), ".texliveonfly") ):
     lockfilePath = os.path.join(tempDirectory,  "newterminal_lock")
     #NOTE: double-escaping \\ is neccessary for a slash to appear in the bash command
@@ -174,7 +221,9 @@ def generateSpeakerFuncs(speech_setting):
 
     return (installspeaker, exiter)
 
-def generateTLMGRFuncs(tlmgr, speaker, sudoFunc):
+#offlineDB: the result of loadTLPDB, to resolve packages without hitting the network
+#repository: where to install packages from, rather than the default (remote) one
+def generateTLMGRFuncs(tlmgr, speaker, sudoFunc, offlineDB = None, repository = None, lookupJobs = defaultLookupJobs):
     #checks that tlmgr is installed, raises OSError otherwise
     #also checks whether we need to escalate permissions, using fake remove command
     process = subprocess.Popen( [ tlmgr,  "remove" ], stdin=subprocess.PIPE, stdout = subprocess.PIPE,  stderr=subprocess.PIPE  )
@@ -183,23 +232,34 @@ def generateTLMGRFuncs(tlmgr, speaker, sudoFunc):
     #does our default user have update permissions?
     default_permission = "don't have permission" not in tlmgr_err
 
+    repositoryArgs = [ "--repository", repository ] if repository != None else []
+    repositoryString = " --repository '{0}'".format(repository) if repository != None else ""
+
+    #lookups run concurrently, so their messages must not interleave
+    outputLock = threading.Lock()
+
     #always call on first update; updates tlmgr and checks permissions
     def initializeInstallation():
         updateInfo = "Updating tlmgr prior to installing packages\n(this is necessary to avoid complaints from itself)."
         print( scriptName + ": " + updateInfo)
 
         if default_permission:
-            process = subprocess.Popen( [tlmgr,  "update",  "--self" ] )
+            process = subprocess.Popen( [tlmgr,  "update",  "--self" ] + repositoryArgs )
             process.wait()
         else:
             print( "\n{0}: Default user doesn't have permission to modify the TeX Live distribution; upgrading to superuser for installation mode.\n".format(scriptName) )
-            basicCommand = ''''{0}' update --self'''.format(tlmgr)
+            basicCommand = ''''{0}' update --self{1}'''.format(tlmgr, repositoryString)
             sudoFunc( basicCommand, '''echo \\"This is {0}'s 'install packages on the fly' feature.\\n\\n{1}\\n\\" ; sudo {2}'''.format(scriptName, updateInfo, basicCommand ) )
 
     def installPackages(packages):
         if len(packages) == 0:
             return
 
+        if offlineDB != None and repository == None:
+            #a package database alone cannot install anything, and the default repository is remote
+            print("{0}: Offline mode without a local mirror; please install LaTeX package(s): {1}".format( scriptName, " ".join(packages) ) )
+            return
+
         global installation_initialized
         if not installation_initialized:
             initializeInstallation()
@@ -209,10 +269,10 @@ def generateTLMGRFuncs(tlmgr, speaker, sudoFunc):
         print("{0}: Attempting to install LaTex package(s): {1}".format( scriptName, packagesString ) )
 
         if default_permission:
-            process = subprocess.Popen( [ tlmgr,  "install"] + packages , stdin=subprocess.PIPE )
+            process = subprocess.Popen( [ tlmgr,  "install"] + repositoryArgs + packages , stdin=subprocess.PIPE )
             process.wait()
         else:
-            basicCommand = ''''{0}' install {1}'''.format(tlmgr,  packagesString)
+            basicCommand = ''''{0}' install{1} {2}'''.format(tlmgr, repositoryString, packagesString)
             bashCommand='''echo \\"This is {0}'s 'install packages on the fly' feature.\\n\\nAttempting to install LaTeX package(s): {1} \\"
 echo \\"(Some of them might not be real.)\\n\\"
 sudo {2}'''.format(scriptName, packagesString, basicCommand)
@@ -222,53 +282,73 @@ sudo {2}'''.format(scriptName, packagesString, basicCommand)
     #strictmatch requires an entire /file match in the search results
     def getSearchResults(preamble, term, strictMatch):
         fontOrFile =  "font" if "font" in preamble else "file"
-        speaker("Searching for missing {0}: {1} ".format(fontOrFile, term))
-        print( "{0}: Searching repositories for missing {1} {2}".format(scriptName, fontOrFile,  term) )
-
-        process = subprocess.Popen([ tlmgr, "search", "--global", "--file", term], stdin=subprocess.PIPE, stdout = subprocess.PIPE, stderr=subprocess.PIPE )
-        ( output ,  stderrdata ) = process.communicateStr()
-        outList = output.split("\n")
-
-        results = ["latex"]    #latex 'result' for removal later
-
-        for line in outList:
-            line = line.strip()
-            if line.startswith(preamble) and (not strictMatch or line.endswith("/" + term)):
-                #filters out the package in:
-                #   texmf-dist/.../package/file
-                #and adds it to packages
-                results.append(line.split("/")[-2].strip())
-                results.append(line.split("/")[-3].strip()) #occasionally the package is one more slash before
-
-        results = list(set(results))    #removes duplicates
-        results.remove("latex")     #removes most common fake result
-
-        if len(results) == 0:
-            speaker("File not found.")
-            print("{0}: No results found for {1}".format( scriptName, term ) )
+        with outputLock:
+            speaker("Searching for missing {0}: {1} ".format(fontOrFile, term))
+            print( "{0}: Searching {1} for missing {2} {3}".format(scriptName, "the local package database" if offlineDB != None else "repositories", fontOrFile,  term) )
+
+        if offlineDB != None:
+            #the package database tells the package of each file exactly
+            results = list(set( name for (path, name) in offlineDB
+                                if path.startswith(preamble) and term in path and (not strictMatch or path.endswith("/" + term)) ))
         else:
-            speaker("Installing.")
+            process = subprocess.Popen([ tlmgr, "search", "--global", "--file", term], stdin=subprocess.PIPE, stdout = subprocess.PIPE, stderr=subprocess.PIPE )
+            ( output ,  stderrdata ) = process.communicateStr()
+            outList = output.split("\n")
+
+            results = ["latex"]    #latex 'result' for removal later
+
+            for line in outList:
+                line = line.strip()
+                if line.startswith(preamble) and (not strictMatch or line.endswith("/" + term)):
+                    #filters out the package in:
+                    #   texmf-dist/.../package/file
+                    #and adds it to packages
+                    results.append(line.split("/")[-2].strip())
+                    results.append(line.split("/")[-3].strip()) #occasionally the package is one more slash before
+
+            results = list(set(results))    #removes duplicates
+            results.remove("latex")     #removes most common fake result
+
+        with outputLock:
+            if len(results) == 0:
+                speaker("File not found.")
+                print("{0}: No results found for {1}".format( scriptName, term ) )
+            else:
+                speaker("Installing.")
 
         return results
 
-    def searchFilePackage(file):
-        return getSearchResults("texmf-dist/", file, True)
+    def fileLookup(file):
+        return ("texmf-dist/", file, True)
 
-    def searchFontPackage(font):
+    def fontLookups(font):
         font = re.sub(r"\((.*)\)", "", font)    #gets rid of parentheses
-        results = getSearchResults("texmf-dist/fonts/", font , False)
-
-        #allow for possibility of lowercase
-        if len(results) == 0:
-            return [] if font.islower() else searchFontPackage(font.lower())
-        else:
-            return results
-
-    def searchAndInstall(searcher,  entry):
-        installPackages(searcher(entry))
-        return entry    #returns the entry just installed
-
-    return ( lambda entry : searchAndInstall(searchFilePackage,  entry),  lambda entry : searchAndInstall(searchFontPackage,  entry) )
+        #allow for possibility of lowercase; looked up right away rather than after the first lookup fails
+        return [ ("texmf-dist/fonts/", font, False) ] + ( [] if font.islower() else [ ("texmf-dist/fonts/", font.lower(), False) ] )
+
+    #looks up all missing files and fonts concurrently (each distinct lookup once) and returns the packages to install
+    def searchPackages(files, fonts):
+        lookups = []
+        for lookup in [ fileLookup(file) for file in files ] + [ lookup for font in fonts for lookup in fontLookups(font) ]:
+            if lookup not in lookups:
+                lookups.append(lookup)
+        results = dict( zip( lookups, boundedMap( lambda lookup : getSearchResults(*lookup), lookups, lookupJobs ) ) )
+
+        packages = set()
+        for file in files:
+            packages.update( results[fileLookup(file)] )
+        for font in fonts:
+            #the first lookup giving any result, i.e. the lowercase name only if the font name gives nothing
+            for lookup in fontLookups(font):
+                if len(results[lookup]) > 0:
+                    packages.update( results[lookup] )
+                    break
+        return sorted(packages)
+
+    def searchAndInstall(files, fonts):
+        installPackages( searchPackages(files, fonts) )
+
+    return searchAndInstall
 
 def generateCompiler(compiler, arguments, texDoc, exiter):
     def compileTexDoc():
@@ -325,6 +405,10 @@ if __name__ == '__main__':
         help='Toggles speech-synthesized notifications (where supported).  OPTION can be "always", "never", "installing", "failed", or some combination.')
     parser.add_option('-f', '--fail_silently', action = "store_true" , dest='fail_silently',
         help="If tlmgr cannot be found, compile document anyway.", default=False)
+    parser.add_option('-j', '--lookup_jobs', type = "int", dest='lookup_jobs', metavar='N', default=defaultLookupJobs,
+        help='Number of missing files/fonts to look up at the same time; default is {0}'.format(defaultLookupJobs))
+    parser.add_option('--offline', dest='offline', metavar='LOCATION', default=None,
+        help="Never hit the network: look packages up in a local TeX Live package database (texlive.tlpdb), or a local mirror containing tlpkg/texlive.tlpdb, which is then also the repository to install from.")
 
     (options, args) = parser.parse_args()
 
@@ -337,10 +421,20 @@ if __name__ == '__main__':
     (installSpeaker, exitScript) = generateSpeakerFuncs(options.speech_setting)
     compileTex = generateCompiler( compiler_path, options.arguments, texDoc, exitScript)
 
+    offlineDB = None
+    repository = None
+    if options.offline != None:
+        try:
+            offlineDB = loadTLPDB(options.offline)
+        except (IOError, OSError) as e:
+            parser.error( "{0}: Unable to read the package database {1}: {2}".format(scriptName, options.offline, e) )
+        repository = localRepository(options.offline)
+
     #initializes tlmgr, responds if the program not found
     try:
         tlmgr_path = os.path.join(options.texlive_bin, "tlmgr")
-        (installFile,  installFont) = generateTLMGRFuncs(tlmgr_path,  installSpeaker,  generateSudoer(options.terminal_only))
+        installMissing = generateTLMGRFuncs(tlmgr_path,  installSpeaker,  generateSudoer(options.terminal_only),
+            offlineDB, repository, options.lookup_jobs)
     except OSError:
         if options.fail_silently:
             (output, returnCode)  = compileTex()
@@ -351,11 +445,13 @@ if __name__ == '__main__':
 
     #loop constraints
     done = False
-    previousFile = ""
-    previousFontFile = ""
-    previousFont =""
+    searchedFiles = set()
+    searchedFonts = set()
+
+    #removes duplicates, keeping the order
+    unique = lambda names : [ name for (i, name) in enumerate(names) if name not in names[:i] ]
 
-    #keeps running until all missing font/file errors are gone, or the same ones persist in all categories
+    #keeps running until all missing font/file errors are gone, or only the ones we already searched for persist
     while not done:
         (output, returnCode)  = compileTex()
 
@@ -367,13 +463,15 @@ if __name__ == '__main__':
         #brute force search for font name in files
         fontsSearch =  re.findall(r"! Font [^\n]*file\:([^\:\n]*)\:", output) + re.findall(r"! Font \\[^/]*/([^/]*)/", output)
 
+        #all new missing files/fonts are resolved at once, and installed together
+        newFiles = [ name for name in unique(filesSearch + fontsFileSearch) if name not in searchedFiles ]
+        newFonts = [ name for name in unique(fontsSearch) if name not in searchedFonts ]
+
         try:
-            if len(filesSearch) > 0 and filesSearch[0] != previousFile:
-                previousFile = installFile(filesSearch[0] )
-            elif len(fontsFileSearch) > 0 and fontsFileSearch[0] != previousFontFile:
-                previousFontFile = installFile(fontsFileSearch[0])
-            elif len(fontsSearch) > 0 and fontsSearch[0] != previousFont:
-                previousFont = installFont(fontsSearch[0])
+            if len(newFiles) > 0 or len(newFonts) > 0:
+                searchedFiles.update(newFiles)
+                searchedFonts.update(newFonts)
+                installMissing(newFiles, newFonts)
             else:
                 done = True
         except OSError:
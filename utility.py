@@ -1,10 +1,10 @@
 from __future__ import print_function
 import errno
 import os
-import shutil
-import subprocess
 import six
-from send2trash import send2trash
+
+# NOTE: `shutil`, `subprocess` and `send2trash` are imported where they are used, so that importing
+#       this module stays cheap for the code paths which do not need them.
 
 
 class ExternalCommandError(Exception):
@@ -14,33 +14,138 @@ class ExternalCommandError(Exception):
 class ExternalCommandWrapper:
     """A simple wrapper for executing all kinds of external commands, e.g., ls"""
 
-    def __init__(self, cmd, cmd_args=None, shell=False, cwd=None, verbose=False):
+    def __init__(self, cmd, cmd_args=None, shell=False, cwd=None, limits=None, verbose=False):
         if cmd_args is None:
             cmd_args = []
         self.cmd = cmd
         self.cmd_args = cmd_args
         self.shell = shell
         self.cwd = cwd
+        self.limits = limits
         self.verbose = verbose
+        self.output = None
 
     def run(self):
-        """Run the command"""
+        """Run the command, keep its output (stdout and stderr) in `self.output` and return its exit code"""
+        import subprocess
+
         full_cmd = [self.cmd]
         if len(self.cmd_args) > 0:
             full_cmd += self.cmd_args
         try:
             if self.verbose:
                 print("Running `{command}`".format(command=" ".join(full_cmd)))
-            p = subprocess.Popen(full_cmd,
-                                 shell=self.shell,
+            args, shell = self.__limited(full_cmd)
+            p = subprocess.Popen(args,
+                                 shell=shell,
                                  cwd=self.cwd,
                                  stdin=subprocess.DEVNULL,
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.STDOUT)
-            p.wait()
-            p.stdout.close()
+            self.output, _ = p.communicate()
+            return p.returncode
+        except OSError as e:
+            raise ExternalCommandError("Failed to execute command: " + str(e))
+
+    async def run_async(self):
+        """Like `run`, but with an asyncio subprocess. If cancelled, the command and its child
+           processes are killed."""
+        import asyncio
+        import subprocess
+
+        full_cmd = [self.cmd]
+        if len(self.cmd_args) > 0:
+            full_cmd += self.cmd_args
+        if self.verbose:
+            print("Running `{command}`".format(command=" ".join(full_cmd)))
+        options = dict(cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if os.name == 'posix':
+            # a process group of its own, so that the whole process tree can be killed
+            options['start_new_session'] = True
+        try:
+            args, shell = self.__limited(full_cmd)
+            if shell:
+                p = await asyncio.create_subprocess_shell(" ".join(args), **options)
+            else:
+                p = await asyncio.create_subprocess_exec(*args, **options)
         except OSError as e:
             raise ExternalCommandError("Failed to execute command: " + str(e))
+        try:
+            self.output, _ = await p.communicate()
+        except asyncio.CancelledError:
+            kill_process_tree(p)
+            await p.wait()
+            raise
+        return p.returncode
+
+    def __limited(self, full_cmd):
+        """Return the arguments to execute `full_cmd` with `self.limits` and whether to use a shell,
+           raising `OSError` if the command does not exist"""
+        prefix = resource_limits_command(self.limits)
+        if self.shell:
+            if len(prefix) == 0:
+                return full_cmd, True
+            return prefix + ['/bin/sh', '-c', " ".join(full_cmd)], False
+        if len(prefix) > 0 and not _is_executable(full_cmd[0], self.cwd):
+            # report it as `Popen` would, rather than as the exit code of the wrapper
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), full_cmd[0])
+        return prefix + full_cmd, False
+
+
+def _is_executable(cmd, cwd=None):
+    import shutil
+
+    if os.path.dirname(cmd):
+        path = os.path.join(cwd or os.curdir, cmd)
+        return os.path.isfile(path) and os.access(path, os.X_OK)
+    return shutil.which(cmd) is not None
+
+
+# sets the resource limits given as arguments (0 for none) and then executes the command which follows
+_LIMITS_SCRIPT = """
+import os, resource, sys
+for rlimit, value in zip((resource.RLIMIT_CPU, resource.RLIMIT_AS), sys.argv[1:3]):
+    if int(value) > 0:
+        resource.setrlimit(rlimit, (int(value), int(value)))
+try:
+    os.execvp(sys.argv[3], sys.argv[3:])
+except OSError as e:
+    sys.stderr.write("Failed to execute command: " + str(e) + "\\n")
+    os._exit(127)
+"""
+
+
+def resource_limits_command(limits):
+    """Return the arguments to put before a command to run it with resource limits, or an empty list
+       if there is no limit. `limits` is a dict which may contain
+           cpu_time: CPU time in seconds
+           memory:   size of the address space in bytes
+       The limits are set by a Python process which then executes the command, rather than in a
+       `preexec_fn`, which is not safe when the parent process has threads.
+       Limits are only supported on POSIX systems and ignored elsewhere.
+    """
+    if not limits or os.name != 'posix':
+        return []
+    cpu_time = int(limits.get('cpu_time') or 0)
+    memory = int(limits.get('memory') or 0)
+    if cpu_time <= 0 and memory <= 0:
+        return []
+    import sys
+
+    return [sys.executable, '-c', _LIMITS_SCRIPT, str(cpu_time), str(memory)]
+
+
+def kill_process_tree(p):
+    """Kill the process `p` (started in a new session on POSIX) and its child processes"""
+    import signal
+
+    try:
+        if os.name == 'posix':
+            os.killpg(p.pid, signal.SIGKILL)
+        else:
+            p.kill()
+    except OSError:
+        pass
 
 
 class FileCopyError(Exception):
@@ -56,6 +161,8 @@ def copy_wrapper(src, dst, symlinks=False, ignore=None):
        and copy all files in `src` to `dst/src`.
 
     """
+    import shutil
+
     if os.path.exists(dst) and os.path.isdir(dst):
         if os.path.isdir(src):
             copy_dir = os.path.basename(src)
@@ -150,8 +257,9 @@ class FileRemoveError(Exception):
 
 
 class FileRemoveWrapper:
-    """Simple wrapper for send2trash"""
-    def __init__(self, verbose=False):
+    """Simple wrapper for send2trash (or `os.remove` if `trash` is False)"""
+    def __init__(self, trash=True, verbose=False):
+        self.trash = trash
         self.verbose = verbose
 
     def remove(self, files, ignore=None):
@@ -167,15 +275,65 @@ class FileRemoveWrapper:
                     self.__remove(file)
 
     def __remove(self, some_file_or_dir):
-        """Send `some_file_or_dir` to trash"""
+        """Send `some_file_or_dir` to trash, or unlink it directly"""
         if self.verbose:
             print("Removing `{0}`".format(some_file_or_dir))
         try:
-            send2trash(some_file_or_dir)
+            if self.trash:
+                from send2trash import send2trash
+                send2trash(some_file_or_dir)
+            elif os.path.isdir(some_file_or_dir):
+                import shutil
+                shutil.rmtree(some_file_or_dir)
+            else:
+                os.remove(some_file_or_dir)
         except OSError as e:
             raise FileRemoveError("Failed to remove `{}`: ".format(some_file_or_dir) + str(e))
 
 
+class FileMoveError(Exception):
+    pass
+
+
+class FileMoveWrapper:
+    """Simple wrapper for `os.replace`"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def move(self, files, dst_dir):
+        """Move file(s) into the directory `dst_dir`, which is created if it does not exist.
+        Note that
+            - `files` can be a str for a file, or a list/tuple for a set of files.
+            - Existing files in `dst_dir` with the same names are overwritten.
+            - `dst_dir` MUST be on the same file system as `files`, since the files are renamed
+              instead of copied.
+        """
+        if isinstance(files, six.string_types):
+            files = [files]
+        assert isinstance(files, list) or isinstance(files, tuple)
+        if len(files) == 0:
+            return
+        try:
+            if not os.path.isdir(dst_dir):
+                os.makedirs(dst_dir)
+        except OSError as e:
+            raise FileMoveError("Failed to create `{}`: ".format(dst_dir) + str(e))
+        for file in files:
+            assert isinstance(file, six.string_types)
+            self.__move(file, dst_dir)
+
+    def __move(self, src, dst_dir):
+        """Move `src` into `dst_dir`"""
+        dst = os.path.join(dst_dir, os.path.basename(src)).replace('\\', '/')
+        if self.verbose:
+            print("Moving `{0}` to `{1}`".format(src, dst))
+        try:
+            os.replace(src, dst)
+        except OSError as e:
+            raise FileMoveError("Failed to move `{0}` to `{1}`: ".format(src, dst) + str(e))
+
+
 class FileFilterError(Exception):
     pass
 
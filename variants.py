@@ -0,0 +1,127 @@
+from __future__ import print_function
+
+import six
+
+# the template used for variants which do not specify one
+VARIANT_TEMPLATE = 'cv_variant.tex'
+
+# sections (in order) of the variants which do not specify them, for each layout
+VARIANT_LAYOUTS = {
+    'multi': ('objective', 'education', 'experience', 'project_full', 'publication', 'talk', 'skill', 'honor',
+              'service'),
+    'single': ('objective', 'education', 'experience', 'project_selected', 'skill'),
+}
+
+# the spacing (tex) before and after a section, by configuration key, as in `cv_multi.tex` and
+# `cv_single.tex`; the last section of a variant is not followed by any
+SECTION_SPACING = {
+    'objective': ('', ''),
+    'education': ('\\negspace', '\\negspace'),
+    'skill': ('', '\\vspace*{4pt}\n\\negspace'),
+    'honor': ('', '\\vspace*{2pt}\n\\negspace'),
+}
+DEFAULT_SECTION_SPACING = ('', '\\negspace')
+
+# the spacing (tex) after the last section, for each layout
+LAYOUT_CLOSINGS = {
+    'multi': '',
+    'single': '\\vspace*{4pt}\n\\negspace',
+}
+
+
+class VariantError(Exception):
+    pass
+
+
+def section_config_key(section):
+    """Return the configuration key of a section, e.g., `project` for `project_selected`"""
+    return section.split('_')[0]
+
+
+def make_section(section):
+    """Return the entry of a section in a variant, e.g., `project_selected`"""
+    key = section_config_key(section)
+    space_before, space_after = SECTION_SPACING.get(key, DEFAULT_SECTION_SPACING)
+    return {'name': section, 'key': key, 'template': section + '.tex',
+            'space_before': space_before, 'space_after': space_after}
+
+
+def load_variants(config, names=None):
+    """Return the variants declared under `variants` in the configuration, as a list of (variant, cv)
+       pairs, where `cv` is the configuration seen by the variant.
+
+       A variant looks like
+           - name: cv_onepage         # the tex file to generate is `cv_onepage.tex`
+             layout: single           # `multi` (default) or `single`
+             template: cv_variant.tex # (optional) template to render
+             sections: [objective, education, experience, project_selected, skill]
+             exclude: [objective]     # (optional) sections to leave out
+             overrides:               # (optional) top-level configuration to replace
+               objective: ...
+
+       `names` restricts the variants to the given names (in the given order).
+       Return None if the configuration does not declare variants.
+    """
+    if not isinstance(config, dict) or 'variants' not in config:
+        if names:
+            raise VariantError("The configuration does not declare any variants")
+        return None
+    specs = config['variants']
+    if not isinstance(specs, list):
+        raise VariantError("`variants` must be a list")
+    # shared (not copied) by all variants, only top-level keys are replaced by overrides
+    base_cv = base_config(config)
+
+    variants = {}
+    order = []
+    for spec in specs:
+        variant, cv = make_variant(spec, base_cv)
+        if variant['name'] in variants:
+            raise VariantError("Duplicate variant `{0}`".format(variant['name']))
+        variants[variant['name']] = (variant, cv)
+        order.append(variant['name'])
+
+    if names:
+        unknown = [name for name in names if name not in variants]
+        if unknown:
+            raise VariantError("Unknown variant(s): {0}".format(", ".join(unknown)))
+        order = list(names)
+    return [variants[name] for name in order]
+
+
+def base_config(config):
+    """Return the configuration without the variant declarations"""
+    return dict((k, v) for k, v in config.items() if k != 'variants')
+
+
+def make_variant(spec, base_cv):
+    """Return the (variant, cv) pair for a variant declaration `spec` (see `load_variants`)"""
+    if not isinstance(spec, dict) or not isinstance(spec.get('name'), six.string_types):
+        raise VariantError("Each variant must be a mapping with a `name`: {0}".format(spec))
+    name = spec['name']
+    layout = spec.get('layout', 'multi')
+    if layout not in VARIANT_LAYOUTS:
+        raise VariantError("Unknown layout `{0}` of variant `{1}` (expected one of: {2})".format(
+            layout, name, ", ".join(sorted(VARIANT_LAYOUTS))))
+    sections = spec.get('sections', VARIANT_LAYOUTS[layout])
+    exclude = spec.get('exclude', [])
+    overrides = spec.get('overrides', {})
+    if not (isinstance(sections, (list, tuple)) and isinstance(exclude, list) and isinstance(overrides, dict)):
+        raise VariantError("`sections` and `exclude` of variant `{0}` must be lists, and `overrides` "
+                           "a mapping".format(name))
+
+    sections = [s for s in sections if s not in exclude]
+    cv = base_cv
+    if overrides:
+        cv = dict(base_cv)
+        cv.update(overrides)
+    variant = {
+        'name': name,
+        'tex_file': name + '.tex',
+        'template': spec.get('template', VARIANT_TEMPLATE),
+        'layout': layout,
+        'sections': [make_section(s) for s in sections],
+        'section_keys': [section_config_key(s) for s in sections],
+        'closing': LAYOUT_CLOSINGS[layout],
+    }
+    return variant, cv
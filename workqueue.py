@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Distributed compiling: `LaTeXCVMaker(spool_dir=...)` renders the tex files centrally and publishes
+   a compile job per tex file to a work queue, and compile workers (possibly on other hosts sharing
+   the spool directory) build them and publish the PDFs and build reports back.
+
+   Usage: python3 workqueue.py SPOOL_DIR [options]    # run a compile worker
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)).replace('\\', '/')
+
+# a job whose worker has not shown any sign of life for so long is considered dead and is requeued
+DEFAULT_LEASE_SECONDS = 60
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# sub-directories of the spool directory, a job moves from one to another with `os.rename`
+SPOOL_STATES = ('pending', 'running', 'done', 'failed')
+SPOOL_TMP_DIR = 'tmp'
+
+JOB_FILE = 'job.json'
+HEARTBEAT_FILE = 'heartbeat'
+ERROR_FILE = 'error.txt'
+FILES_DIR = 'files'
+OUTPUT_DIR = 'out'
+
+
+class WorkQueueError(Exception):
+    pass
+
+
+class WorkQueue:
+    """The interface of work queue backends.
+
+       A job is a spec (a JSON-serializable dict) together with its input files. Each job is
+       claimed by one worker at a time, and is delivered again if its worker dies, so a job can be
+       executed more than once, but its outputs are published only once.
+    """
+
+    def submit(self, spec, files):
+        """Publish a job and return its id"""
+        raise NotImplementedError
+
+    def claim(self):
+        """Claim the next pending job and return it (a `Job`), or None if there is none"""
+        raise NotImplementedError
+
+    def heartbeat(self, job):
+        """Renew the lease of a claimed job, return False if the job is no longer ours"""
+        raise NotImplementedError
+
+    def complete(self, job, outputs):
+        """Publish the output files of a claimed job, return False if the job is no longer ours"""
+        raise NotImplementedError
+
+    def fail(self, job, error):
+        """Give a claimed job back for a retry, or mark it as failed if it ran out of attempts"""
+        raise NotImplementedError
+
+    def recover(self):
+        """Requeue the jobs whose workers died, and return how many"""
+        raise NotImplementedError
+
+    def status(self, job_id):
+        """Return `pending`, `running`, `done`, `failed`, or None if the job does not exist"""
+        raise NotImplementedError
+
+    def outputs(self, job_id):
+        """Return the paths of the output files of a done job"""
+        raise NotImplementedError
+
+    def error(self, job_id):
+        """Return the error of a failed job"""
+        raise NotImplementedError
+
+    def remove(self, job_id):
+        raise NotImplementedError
+
+
+class Job:
+    def __init__(self, job_id, spec, files_dir):
+        self.id = job_id
+        self.spec = spec
+        # where the input files of the job are
+        self.files_dir = files_dir
+
+
+class SpoolQueue(WorkQueue):
+    """A work queue in a (shared) spool directory, with a sub-directory per job state.
+
+       Jobs are written in `tmp/` and then renamed into `pending/`. A worker claims a job by
+       renaming it from `pending/` to `running/`, which succeeds for only one of the workers
+       trying, so no locks are needed. While a job runs, its worker touches its heartbeat file;
+       when the heartbeat is older than the lease, the job is renamed back to `pending/`.
+    """
+
+    def __init__(self, spool_dir, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 verbose=False):
+        self.spool_dir = os.path.abspath(spool_dir).replace('\\', '/')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.verbose = verbose
+        try:
+            for state in SPOOL_STATES + (SPOOL_TMP_DIR,):
+                if not os.path.isdir(self.__state_dir(state)):
+                    os.makedirs(self.__state_dir(state))
+        except OSError as e:
+            raise WorkQueueError("Failed to create spool directory `{0}`: ".format(self.spool_dir) + str(e))
+
+    def __state_dir(self, state):
+        return os.path.join(self.spool_dir, state).replace('\\', '/')
+
+    def __job_dir(self, state, job_id):
+        return os.path.join(self.spool_dir, state, job_id).replace('\\', '/')
+
+    def __move(self, job_id, src_state, dst_state):
+        """Move a job from one state to another, return False if it is not in `src_state` (any more)"""
+        try:
+            os.rename(self.__job_dir(src_state, job_id), self.__job_dir(dst_state, job_id))
+            return True
+        except OSError:
+            return False
+
+    def submit(self, spec, files):
+        # ids sort by submission time, so that older jobs are claimed first
+        job_id = '{0:013d}-{1}'.format(int(time.time() * 1000), uuid.uuid4().hex[:12])
+        job_dir = self.__job_dir(SPOOL_TMP_DIR, job_id)
+        spec = dict(spec, attempts=0, max_attempts=spec.get('max_attempts', self.max_attempts),
+                    lease_seconds=spec.get('lease_seconds', self.lease_seconds))
+        try:
+            files_dir = os.path.join(job_dir, FILES_DIR)
+            os.makedirs(files_dir)
+            for f in files:
+                dst = os.path.join(files_dir, os.path.basename(f))
+                if os.path.isdir(f):
+                    shutil.copytree(f, dst)
+                else:
+                    shutil.copy2(f, dst)
+            self.__write_spec(job_dir, spec)
+            os.rename(job_dir, self.__job_dir('pending', job_id))
+        except OSError as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise WorkQueueError("Failed to submit job: " + str(e))
+        if self.verbose:
+            print("Submitted job `{0}`".format(job_id))
+        return job_id
+
+    def claim(self):
+        try:
+            job_ids = sorted(os.listdir(self.__state_dir('pending')))
+        except OSError:
+            return None
+        for job_id in job_ids:
+            if not self.__move(job_id, 'pending', 'running'):
+                # claimed by another worker
+                continue
+            job_dir = self.__job_dir('running', job_id)
+            try:
+                self.__touch(job_dir)
+                spec = self.__read_spec(job_dir)
+                spec['attempts'] += 1
+                self.__write_spec(job_dir, spec)
+            except (OSError, ValueError, KeyError):
+                # requeued (or removed) meanwhile
+                continue
+            job = Job(job_id, spec, os.path.join(job_dir, FILES_DIR).replace('\\', '/'))
+            if spec['attempts'] > spec['max_attempts']:
+                self.__give_up(job, "Gave up after {0} attempt(s)".format(spec['max_attempts']))
+                continue
+            if self.verbose:
+                print("Claimed job `{0}` (attempt {1})".format(job_id, spec['attempts']))
+            return job
+        return None
+
+    def heartbeat(self, job):
+        try:
+            self.__touch(self.__job_dir('running', job.id))
+            return True
+        except OSError:
+            return False
+
+    def complete(self, job, outputs):
+        output_dir = os.path.join(self.__job_dir('running', job.id), OUTPUT_DIR)
+        try:
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            for f in outputs:
+                shutil.copy2(f, output_dir)
+        except OSError:
+            return False
+        return self.__move(job.id, 'running', 'done')
+
+    def fail(self, job, error):
+        if self.verbose:
+            print("Job `{0}` failed (attempt {1}): {2}".format(job.id, job.spec['attempts'], error))
+        if job.spec['attempts'] < job.spec['max_attempts']:
+            return self.__move(job.id, 'running', 'pending')
+        return self.__give_up(job, error)
+
+    def __give_up(self, job, error):
+        try:
+            with open(os.path.join(self.__job_dir('running', job.id), ERROR_FILE), 'w') as f:
+                f.write(error)
+        except OSError:
+            return False
+        return self.__move(job.id, 'running', 'failed')
+
+    def recover(self):
+        recovered = 0
+        now = time.time()
+        try:
+            job_ids = os.listdir(self.__state_dir('running'))
+        except OSError:
+            return 0
+        for job_id in job_ids:
+            job_dir = self.__job_dir('running', job_id)
+            try:
+                lease_seconds = self.__read_spec(job_dir).get('lease_seconds', self.lease_seconds)
+                heartbeat = os.path.getmtime(os.path.join(job_dir, HEARTBEAT_FILE))
+            except (OSError, ValueError):
+                # just claimed, or already gone
+                continue
+            if now - heartbeat > lease_seconds and self.__move(job_id, 'running', 'pending'):
+                if self.verbose:
+                    print("Requeued job `{0}` whose worker is gone".format(job_id))
+                recovered += 1
+        return recovered
+
+    def status(self, job_id):
+        for state in SPOOL_STATES:
+            if os.path.isdir(self.__job_dir(state, job_id)):
+                return state
+        # it can be moving between states, so look again
+        for state in SPOOL_STATES:
+            if os.path.isdir(self.__job_dir(state, job_id)):
+                return state
+        return None
+
+    def outputs(self, job_id):
+        output_dir = os.path.join(self.__job_dir('done', job_id), OUTPUT_DIR).replace('\\', '/')
+        if not os.path.isdir(output_dir):
+            return []
+        return [os.path.join(output_dir, f).replace('\\', '/') for f in sorted(os.listdir(output_dir))]
+
+    def error(self, job_id):
+        try:
+            with open(os.path.join(self.__job_dir('failed', job_id), ERROR_FILE), 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def remove(self, job_id):
+        for state in SPOOL_STATES:
+            shutil.rmtree(self.__job_dir(state, job_id), ignore_errors=True)
+
+    @staticmethod
+    def __touch(job_dir):
+        with open(os.path.join(job_dir, HEARTBEAT_FILE), 'w'):
+            pass
+
+    @staticmethod
+    def __read_spec(job_dir):
+        with open(os.path.join(job_dir, JOB_FILE), 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def __write_spec(job_dir, spec):
+        job_file = os.path.join(job_dir, JOB_FILE)
+        with open(job_file + '.tmp', 'w') as f:
+            json.dump(spec, f)
+        os.replace(job_file + '.tmp', job_file)
+
+
+class CompileWorker:
+    """Claim compile jobs from a work queue, build them in a temporary directory and publish the PDF
+       and the build report (`<name>.report.json`) back.
+
+       A job spec contains `tex_file` (the name of the tex file among the job files), `build_cmds`
+       (custom build commands, or None for the built-in ones) and `limits` (see `LaTeXCVMaker`).
+    """
+
+    def __init__(self, queue, tool_dir=os.path.join(PACKAGE_DIR, 'tools'), limits=None, verbose=False):
+        self.queue = queue
+        self.tool_dir = tool_dir
+        self.limits = limits
+        self.verbose = verbose
+
+    def run(self, poll_interval=1.0, max_idle=None, max_jobs=None):
+        """Process jobs until `max_jobs` are processed or no job came for `max_idle` seconds (if given)"""
+        processed = 0
+        idle_since = time.time()
+        while max_jobs is None or processed < max_jobs:
+            self.queue.recover()
+            job = self.queue.claim()
+            if job is None:
+                if max_idle is not None and time.time() - idle_since >= max_idle:
+                    break
+                time.sleep(poll_interval)
+                continue
+            self.process(job)
+            processed += 1
+            idle_since = time.time()
+        return processed
+
+    def process(self, job):
+        import traceback
+        from latexcv import LaTEXCVMakerError, make_build_steps
+        from pipeline import BuildPipeline, BuildPipelineError
+        from utility import ExternalCommandError
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.__heartbeat, args=(job, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        work_dir = tempfile.mkdtemp(prefix='latexcv-worker-').replace('\\', '/')
+        try:
+            build_dir = os.path.join(work_dir, 'build').replace('\\', '/')
+            shutil.copytree(job.files_dir, build_dir)
+            tex_file = os.path.join(build_dir, job.spec['tex_file']).replace('\\', '/')
+            steps = make_build_steps(job.spec.get('build_cmds'), self.tool_dir, self.verbose)
+            limits = job.spec.get('limits') or self.limits
+            report = BuildPipeline(steps, cwd=build_dir, limits=limits, verbose=self.verbose).run(tex_file)
+
+            stem = os.path.splitext(tex_file)[0]
+            if not os.path.exists(stem + '.pdf'):
+                errors = "; ".join(error['message'] for error in report['errors'])
+                raise WorkQueueError("No PDF was produced{0}".format((": " + errors) if errors else ""))
+            with open(stem + '.report.json', 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            outputs = [stem + ext for ext in ('.pdf', '.report.json') if os.path.exists(stem + ext)]
+            stop.set()
+            heartbeat.join()
+            if not self.queue.complete(job, outputs) and self.verbose:
+                print("Dropped the results of job `{0}`, which has been requeued".format(job.id))
+        except (OSError, KeyError, LaTEXCVMakerError, BuildPipelineError, ExternalCommandError, WorkQueueError) as e:
+            stop.set()
+            heartbeat.join()
+            self.queue.fail(job, str(e))
+        except Exception as e:
+            # keep the worker (and the job) going whatever happens
+            print("Unexpected error in job `{0}`:\n{1}".format(job.id, traceback.format_exc()))
+            stop.set()
+            heartbeat.join()
+            self.queue.fail(job, "Unexpected error: {0}".format(e))
+        finally:
+            stop.set()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def __heartbeat(self, job, stop):
+        interval = job.spec.get('lease_seconds', DEFAULT_LEASE_SECONDS) / 4.0
+        while not stop.wait(interval):
+            if not self.queue.heartbeat(job):
+                return
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Compile worker of LaTeXCV, which builds the jobs '
+                                                     'published by `latexcv.py --spool-dir SPOOL_DIR`')
+    arg_parser.add_argument('spool_dir', metavar='SPOOL_DIR', help='Spool directory shared with latexcv.py')
+    arg_parser.add_argument('--tool-dir', metavar='DIR', dest='tool_dir', default=os.path.join(PACKAGE_DIR, 'tools'),
+                            help='Directory of the LaTeX compiling scripts (default: `tools`)')
+    arg_parser.add_argument('--poll', metavar='SECONDS', type=float, dest='poll', default=1.0,
+                            help='How often to look for jobs (default: 1)')
+    arg_parser.add_argument('--max-idle', metavar='SECONDS', type=float, dest='max_idle',
+                            help='Exit after having no job for so long (default: never)')
+    arg_parser.add_argument('--cpu-time', metavar='SECONDS', type=int, dest='cpu_time',
+                            help='Limit the CPU time of each build command (POSIX only)')
+    arg_parser.add_argument('--memory', metavar='MB', type=int, dest='memory',
+                            help='Limit the memory (address space) of each build command in megabytes '
+                                 '(POSIX only)')
+    arg_parser.add_argument('-v', action='store_true', dest='verbose', help='Show verbose information.')
+    args = arg_parser.parse_args()
+
+    limits = None
+    if args.cpu_time or args.memory:
+        limits = {'cpu_time': args.cpu_time, 'memory': args.memory << 20 if args.memory else None}
+    try:
+        queue = SpoolQueue(args.spool_dir, verbose=args.verbose)
+        CompileWorker(queue, tool_dir=args.tool_dir, limits=limits, verbose=args.verbose).run(
+            poll_interval=args.poll, max_idle=args.max_idle)
+    except WorkQueueError as e:
+        print(str(e))
+        return 1
+    except KeyboardInterrupt:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())